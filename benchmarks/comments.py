@@ -0,0 +1,130 @@
+"""Sustained comment-posting throughput with several worker processes.
+
+Starts --processes processes on one database, like gunicorn workers, each
+posting comments through db.addcomment from --threads threads (threaded or
+ASGI workers handle requests concurrently) for --duration seconds, and
+counts the writes that failed, e.g. with "database is locked".
+
+With --before each comment is posted the way addcomment did before the
+writer thread: its id from a SELECT COUNT(*) on one connection, then an
+INSERT committed on its own, so the two can be compared on the same machine.
+
+    python -m benchmarks.comments
+    python -m benchmarks.comments --before
+    python -m benchmarks.comments --processes 4 --threads 8 --duration 10
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+from functools import partial
+
+import aiosqlite
+
+from .common import make_app
+
+
+async def addcomment_before(database, year, week, weekday, value, authorid):
+    """db.addcomment as it was before writes went through db.writer."""
+    async with aiosqlite.connect(database) as conn:
+        async with aiosqlite.connect(database) as other:
+            async with other.execute("SELECT COUNT(*) FROM comments") as cursor:
+                (ca,) = await cursor.fetchone()
+        await conn.execute(
+            "INSERT INTO comments ( year, week, day, author, value, id ) VALUES ( ?, ?, ?, ?, ?, ? )",
+            (year, week, weekday, authorid, value, ca),
+        )
+        await conn.commit()
+
+
+def worker(database, threads, duration, before, results):
+    os.environ["DATABASE"] = database
+    from skolmaten import create_app, db
+
+    create_app()
+    if before:
+        addcomment = partial(addcomment_before, database)
+    else:
+        addcomment = db.addcomment
+    stop = time.monotonic() + duration
+    latencies, errors = [], {}
+    lock = threading.Lock()
+
+    def post(n):
+        async def run():
+            i = 0
+            while time.monotonic() < stop:
+                start = time.perf_counter()
+                try:
+                    await addcomment(2025, 10, i % 5, f"kommentar {n}-{i}", 0)
+                except Exception as e:
+                    with lock:
+                        errors[str(e)] = errors.get(str(e), 0) + 1
+                else:
+                    with lock:
+                        latencies.append(time.perf_counter() - start)
+                i += 1
+
+        asyncio.run(run())
+
+    pool = [threading.Thread(target=post, args=(n,)) for n in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    results.put((latencies, errors))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument(
+        "--before", action="store_true", help="post without the writer thread"
+    )
+    args = parser.parse_args()
+
+    app = make_app()
+    database = app.config["DATABASE"]
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    procs = [
+        ctx.Process(
+            target=worker,
+            args=(database, args.threads, args.duration, args.before, results),
+        )
+        for _ in range(args.processes)
+    ]
+    for p in procs:
+        p.start()
+    latencies, errors = [], {}
+    for _ in procs:
+        lat, err = results.get()
+        latencies += lat
+        for message, count in err.items():
+            errors[message] = errors.get(message, 0) + count
+    for p in procs:
+        p.join()
+
+    latencies.sort()
+    print(
+        f"{args.processes} processes x {args.threads} threads, {args.duration:g}s"
+        + (", before the writer" if args.before else "")
+    )
+    if latencies:
+        print(
+            f"{len(latencies) / args.duration:8.1f} comments/s   "
+            f"p50 {latencies[len(latencies) // 2] * 1000:6.1f} ms   "
+            f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:6.1f} ms"
+        )
+    print(f"{sum(errors.values()):8d} failed")
+    for message, count in sorted(errors.items(), key=lambda e: -e[1]):
+        print(f"{count:8d}  {message}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""Helpers shared by the benchmark scripts.
+
+Every benchmark runs against a throwaway database so it can be pointed at a
+checkout without touching the real `database.db`.
+"""
+
+import asyncio
+import os
+import tempfile
+
+from skolmaten import create_app, db
+
+
+def make_app():
+    """Create the app on top of an empty database in a temporary directory."""
+    tmp = tempfile.mkdtemp(prefix="skolmaten-bench-")
+    os.environ["DATABASE"] = os.path.join(tmp, "database.db")
+    return create_app()
+
+
+def seed_week(year, week, comments_per_day=3):
+    async def seed():
+        for day in range(1, 6):
+            await db.set_food(year, week, day, f"Rätt {day} vecka {week}")
+        for day in range(5):
+            for n in range(comments_per_day):
+                await db.addcomment(year, week, day, f"kommentar {n}", 0)
+
+    asyncio.run(seed())
+
+
+def seed_comments(year, weeks, per_day):
+    """Bulk-insert comments straight into SQLite; addcomment is far too slow for this."""
+    import sqlite3
+
+    conn = sqlite3.connect(os.environ["DATABASE"])
+    start = conn.execute("SELECT COUNT(*) FROM comments").fetchone()[0]
+    rows = (
+        (year, week, day, start + i, f"kommentar {i}", 0)
+        for i, (week, day) in enumerate(
+            (week, day) for week in weeks for day in range(5) for _ in range(per_day)
+        )
+    )
+    conn.executemany(
+        "INSERT INTO comments (year, week, day, id, value, author) VALUES (?, ?, ?, ?, ?, ?)",
+        rows,
+    )
+    conn.commit()
+    conn.close()
+
+
+def timed(fn, repeat):
+    """Run the coroutine function `fn` `repeat` times; return (seconds per call, connects per call)."""
+    import time
+
+    async def run():
+        for _ in range(repeat):
+            await fn()
+
+    before = db.pool.stats()["acquired"]
+    start = time.perf_counter()
+    asyncio.run(run())
+    elapsed = time.perf_counter() - start
+    return elapsed / repeat, (db.pool.stats()["acquired"] - before) / repeat
+
+
+def serve(command, port, database):
+    """Start a server subprocess on `port` and wait until it answers."""
+    import subprocess
+    import sys
+    import time
+    import urllib.request
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    proc = subprocess.Popen(
+        [sys.executable, "-m", *command],
+        cwd=root,
+        env={**os.environ, "DATABASE": database},
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    for _ in range(100):
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/year/2000")
+            return proc
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError(f"{command[0]} did not start")
+
+
+def hammer(url, clients, duration):
+    """Fetch `url` from `clients` threads for `duration` seconds.
+
+    Returns (requests per second, p50 seconds, p99 seconds, errors).
+    """
+    import threading
+    import time
+    import urllib.request
+
+    stop = time.monotonic() + duration
+    latencies, errors = [], []
+
+    def client():
+        while time.monotonic() < stop:
+            start = time.perf_counter()
+            try:
+                urllib.request.urlopen(url).read()
+            except OSError as e:
+                errors.append(e)
+                continue
+            latencies.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    latencies.sort()
+    if not latencies:
+        return 0.0, 0.0, 0.0, len(errors)
+    return (
+        len(latencies) / duration,
+        latencies[len(latencies) // 2],
+        latencies[int(len(latencies) * 0.99)],
+        len(errors),
+    )
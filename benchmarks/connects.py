@@ -0,0 +1,50 @@
+"""How many database connects does one page render cost, and what do they take?
+
+Renders /week/<week> with the page cache cleared before every request, first
+with a pool that keeps no idle connections, so every connection db.py asks
+for is a fresh connect as it was before the pool, then with the pool as
+configured. Prints connects and milliseconds per request for both.
+
+    python -m benchmarks.connects
+"""
+
+import time
+
+from skolmaten import app as views
+from skolmaten import db
+
+from .common import make_app, seed_week
+
+REQUESTS = 200
+
+
+def render(client) -> tuple[float, float]:
+    """Return (connects per request, milliseconds per request)."""
+    client.get("/week/10?year=2025")  # warm up everything but the connections
+    before = db.pool.stats()["opened"]
+    start = time.perf_counter()
+    for _ in range(REQUESTS):
+        views.page_cache.clear()
+        client.get("/week/10?year=2025")
+    elapsed = time.perf_counter() - start
+    opened = db.pool.stats()["opened"] - before
+    return opened / REQUESTS, elapsed / REQUESTS * 1000
+
+
+def main():
+    app = make_app()
+    seed_week(2025, 10)
+    client = app.test_client()
+
+    size = db.pool.size
+    db.pool.size = 0
+    connects, ms = render(client)
+    print(f"/week/<week> without pooling: {connects:.1f} connects, {ms:.2f} ms/request")
+
+    db.pool.size = size
+    connects, ms = render(client)
+    print(f"/week/<week> with pooling:    {connects:.1f} connects, {ms:.2f} ms/request")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+"""HTTP load test of the main routes against a seeded database.
+
+Seeds a temporary database (see benchmarks.seed), boots the app and drives
+each scenario with concurrent clients in turn, reporting throughput,
+p50/p95/p99 latency and, for the in-process server, SQL statements per
+request. Results are written as JSON so runs can be diffed across releases:
+
+    python -m benchmarks.load --out before.json
+    python -m benchmarks.load --out after.json --compare before.json
+
+--server werkzeug (default) runs create_app() in this process on a threaded
+werkzeug server; gunicorn and uvicorn start the real servers with one worker,
+in which case SQL counts aren't available.
+"""
+
+import argparse
+import asyncio
+import http.client
+import json
+import logging
+import os
+import random
+import subprocess
+import threading
+import time
+import urllib.parse
+
+from skolmaten import db
+
+from . import seed
+from .common import make_app, serve
+
+PORT = 8767
+
+SERVERS = {
+    "gunicorn": f"gunicorn -w 1 -b 127.0.0.1:{PORT} skolmaten:create_app()",
+    "uvicorn": f"uvicorn --factory skolmaten.asgi:create_asgi_app --port {PORT}",
+}
+
+
+def scenarios(weeks, users, rng):
+    """name -> function returning (method, path, body, headers) for one request."""
+    login_body = lambda: urllib.parse.urlencode(
+        {"username": f"user{rng.randrange(1, users + 1)}", "password": seed.SEED_PASSWORD}
+    )
+    form = {"Content-Type": "application/x-www-form-urlencoded"}
+
+    def week():
+        year, week = rng.choice(weeks)
+        return "GET", f"/week/{week}?year={year}", None, {}
+
+    def day():
+        year, week = rng.choice(weeks)
+        return "GET", f"/comments/day/{year}/{week}/{rng.randrange(5)}", None, {}
+
+    return {
+        "root": lambda: ("GET", "/", None, {}),
+        "week": week,
+        "year": lambda: ("GET", f"/year/{rng.choice(weeks)[0]}", None, {}),
+        "comments_day": day,
+        "comments_all_page": lambda: ("GET", "/comments/all?limit=100", None, {}),
+        "comments_all": lambda: ("GET", "/comments/all", None, {}),
+        "login": lambda: ("POST", "/login", login_body(), form),
+    }
+
+
+def drive(make_request, clients, duration):
+    stop = time.monotonic() + duration
+    latencies, errors = [], []
+    lock = threading.Lock()
+
+    def client():
+        conn = http.client.HTTPConnection("127.0.0.1", PORT, timeout=60)
+        while time.monotonic() < stop:
+            method, path, body, headers = make_request()
+            start = time.perf_counter()
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                resp = conn.getresponse()
+                resp.read()
+                ok = resp.status < 400
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                ok = False
+            elapsed = time.perf_counter() - start
+            with lock:
+                (latencies if ok else errors).append(elapsed)
+        conn.close()
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return sorted(latencies), len(errors)
+
+
+def percentile(latencies, p):
+    if not latencies:
+        return None
+    return round(latencies[min(int(len(latencies) * p), len(latencies) - 1)] * 1000, 2)
+
+
+def run(args):
+    app = make_app()
+    scale = seed.scale(args.years, args.users, args.comments)
+    weeks = asyncio.run(seed.seed(scale))
+    rng = random.Random(1)
+
+    proc = server = None
+    if args.server == "werkzeug":
+        from werkzeug.serving import make_server
+
+        logging.getLogger("werkzeug").setLevel(logging.WARNING)
+        server = make_server("127.0.0.1", PORT, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    else:
+        proc = serve(SERVERS[args.server].split(), PORT, app.config["DATABASE"])
+
+    results = {}
+    try:
+        for name, make_request in scenarios(weeks, args.users, rng).items():
+            if args.only and name not in args.only:
+                continue
+            queries = db.pool.stats()["queries"]
+            latencies, errors = drive(make_request, args.clients, args.duration)
+            done = len(latencies)
+            results[name] = {
+                "requests": done,
+                "errors": errors,
+                "rps": round(done / args.duration, 1),
+                "p50_ms": percentile(latencies, 0.50),
+                "p95_ms": percentile(latencies, 0.95),
+                "p99_ms": percentile(latencies, 0.99),
+                "queries_per_request": (
+                    round((db.pool.stats()["queries"] - queries) / (done + errors), 2)
+                    if server is not None and done + errors
+                    else None
+                ),
+            }
+    finally:
+        if server is not None:
+            server.shutdown()
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+
+    return {
+        "revision": revision(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "server": args.server,
+        "clients": args.clients,
+        "duration": args.duration,
+        "scale": scale,
+        "results": results,
+    }
+
+
+def revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except OSError:
+        return None
+
+
+def report(run, baseline=None):
+    print(
+        f"{run['server']} @ {run['revision']}, {run['clients']} clients, "
+        f"{run['duration']:g}s per scenario, scale {run['scale']}"
+    )
+    print(
+        f"{'scenario':>18} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+        f"{'sql/req':>8} {'errors':>6}"
+    )
+    for name, r in run["results"].items():
+        line = (
+            f"{name:>18} {r['rps']:8.1f} {r['p50_ms'] or 0:8.1f} {r['p95_ms'] or 0:8.1f} "
+            f"{r['p99_ms'] or 0:8.1f} {r['queries_per_request'] or 0:8.2f} {r['errors']:6d}"
+        )
+        old = (baseline or {}).get("results", {}).get(name)
+        if old and old["rps"] and old["p99_ms"] and r["p99_ms"]:
+            line += (
+                f"   req/s {(r['rps'] / old['rps'] - 1) * 100:+6.1f}%"
+                f"  p99 {(r['p99_ms'] / old['p99_ms'] - 1) * 100:+6.1f}%"
+            )
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--server", choices=["werkzeug", *SERVERS], default="werkzeug")
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--years", type=int, default=2)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--comments", type=int, default=20000)
+    parser.add_argument("--only", nargs="*", help="scenarios to run")
+    parser.add_argument("--out", help="write results as JSON here")
+    parser.add_argument("--compare", help="JSON results of an earlier run")
+    args = parser.parse_args()
+
+    results = run(args)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    report(results, baseline)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
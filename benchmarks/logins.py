@@ -0,0 +1,80 @@
+"""Login throughput versus week page latency during a login burst.
+
+Runs LOGIN_THREADS clients logging in back to back while one client keeps
+loading /week/<week>, once with bcrypt inline on the request thread and once
+on the bounded hasher.
+
+    python -m benchmarks.logins
+"""
+
+import statistics
+import threading
+import time
+
+from skolmaten import db
+from skolmaten.hashing import Hasher
+
+from .common import make_app, seed_week
+
+LOGIN_THREADS = 16
+DURATION = 5.0
+
+MODES = {
+    "inline": Hasher(0),
+    "2 workers, queue 4": Hasher(2, 4),
+}
+
+
+def run(app):
+    stop = time.monotonic() + DURATION
+    results = {"ok": 0, "rejected": 0}
+    lock = threading.Lock()
+    latencies = []
+
+    def login():
+        client = app.test_client()
+        while time.monotonic() < stop:
+            r = client.post(
+                "/login", data={"username": "adminacc", "password": "adminpassword"}
+            )
+            with lock:
+                results["ok" if r.status_code == 302 else "rejected"] += 1
+
+    def browse():
+        client = app.test_client()
+        while time.monotonic() < stop:
+            start = time.perf_counter()
+            client.get("/week/10?year=2025")
+            latencies.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=login) for _ in range(LOGIN_THREADS)]
+    threads.append(threading.Thread(target=browse))
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    latencies.sort()
+    return (
+        results["ok"] / DURATION,
+        results["rejected"] / DURATION,
+        statistics.median(latencies) * 1000,
+        latencies[int(len(latencies) * 0.99)] * 1000,
+    )
+
+
+def main():
+    app = make_app()
+    seed_week(2025, 10)
+    for name, hasher in MODES.items():
+        db.hasher = hasher
+        ok, rejected, p50, p99 = run(app)
+        print(
+            f"{name:>20}: {ok:6.1f} logins/s, {rejected:6.1f} rejected/s, "
+            f"week p50 {p50:7.1f} ms, p99 {p99:7.1f} ms"
+        )
+        hasher.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Menu reads: SQLite on every call versus the in-memory menu store.
+
+Seeds --years of menus, then times get_food and get_food_year as they were
+(a pooled query each, and the year's rows rebuilt every time) against the
+db functions reading db.menus, and the store reloading a year after a write.
+
+    python -m benchmarks.menus
+"""
+
+import argparse
+import asyncio
+import datetime
+
+from skolmaten import db
+
+from . import seed
+from .common import make_app, timed
+
+REPEAT = 200
+
+
+async def old_get_food(year, week, day):
+    async with db.connect() as conn:
+        async with conn.execute(
+            f"SELECT {db.weekdays[day]} FROM weeks WHERE week = ? and year = ?",
+            (week, year),
+        ) as cursor:
+            val = await cursor.fetchone()
+            return val[0] if val else ""
+
+
+async def old_get_food_year(year):
+    async with db.connect() as conn:
+        async with conn.execute(
+            "SELECT week, mon, tue, wed, thu, fri FROM weeks WHERE year = ?", (year,)
+        ) as cursor:
+            existing = {row[0]: row[1:] for row in await cursor.fetchall()}
+
+    total_weeks = datetime.date(year, 12, 28).isocalendar()[1]
+    result = []
+    for week in range(1, total_weeks + 1):
+        date = datetime.datetime.fromisocalendar(year, week, 1)
+        days = list(existing.get(week, [""] * 5))
+        result.append(
+            {
+                "date": date,
+                "week": week,
+                "days": [{"text": days[i], "day": i + 1} for i in range(5)],
+            }
+        )
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--years", type=int, default=10)
+    args = parser.parse_args()
+
+    make_app()
+    weeks = asyncio.run(seed.seed(seed.scale(args.years, 10, 0)))
+    year, week = weeks[len(weeks) // 2]
+
+    async def written():
+        await db.set_food(year, week, 1, "Pannkakor med sylt")
+        await db.get_food_year(year)
+
+    cases = [
+        ("get_food  sql", lambda: old_get_food(year, week, 2)),
+        ("get_food  store", lambda: db.get_food(year, week, 2)),
+        ("get_food_year sql", lambda: old_get_food_year(year)),
+        ("get_food_year store", lambda: db.get_food_year(year)),
+        ("set_food + reload", written),
+    ]
+    print(f"{args.years} years of menus")
+    for name, fn in cases:
+        latency, connects = timed(fn, REPEAT)
+        print(f"{name:>20}: {latency * 1e6:8.1f} us, {connects:4.1f} connections")
+    print(f"{'':>20}  {db.menus.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""PDF menu extraction: one process versus a pool, and the page cache.
+
+Writes a --pages page menu PDF in the caterer's layout (one week per page),
+then times the original sequential parse_pdf + parse_menu against
+extract_pages on a process pool feeding parse_menu, and checks both give
+the same JSON. Then times extract_pages with an empty page cache, again
+with the cache filled, and on the PDF rewritten with one more week.
+
+    python -m benchmarks.pdf
+    python -m benchmarks.pdf --pages 200 --workers 4
+"""
+
+import argparse
+import json
+import os
+import re
+import tempfile
+import time
+from collections import defaultdict
+
+from PyPDF2 import PdfReader
+
+from skolmaten import pdf2json, pdfcache
+
+from .seed import DISHES
+
+DAYS = ["Mån", "Tis", "Ons", "Tor", "Fre"]
+
+
+def make_pdf(path, pages, filler=300):
+    """A minimal PDF with one menu week per page, in Helvetica/WinAnsi.
+
+    Each page also gets `filler` separately placed lines of allergen notes,
+    since real menus are mostly small positioned text runs and those are
+    what makes extraction slow.
+    """
+
+    def text(s):
+        escaped = s.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+        return escaped.encode("cp1252")
+
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # the page tree, once the pages are known
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+    ]
+    kids = []
+    for n in range(pages):
+        week = n % 52 + 1
+        lines = [f"Matsedel V. {week}"]
+        for d, day in enumerate(DAYS):
+            dish = DISHES[(n * 5 + d) % len(DISHES)]
+            # the stray spaces are what parse_menu normalises
+            lines.append(f"{day} {d + 1}/{week % 12 + 1}   {dish} ,  serveras med   sallad")
+        notes = b" ".join(
+            b"1 0 0 1 %d %d Tm (%s) Tj"
+            % (
+                40 + i % 3 * 180,
+                600 - i // 3 % 60 * 9,
+                text(f"Allergener {i}: gluten, laktos, ägg – {DISHES[i % len(DISHES)]}"),
+            )
+            for i in range(filler)
+        )
+        stream = (
+            b"BT /F1 11 Tf 14 TL 50 780 Td "
+            + b" ".join(b"(" + text(line) + b") Tj T*" for line in lines)
+            + b" ET BT /F1 6 Tf "
+            + notes
+            + b" ET"
+        )
+        objects.append(
+            b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream"
+        )
+        content = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content
+        )
+        kids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(b"%d 0 R" % k for k in kids),
+        len(kids),
+    )
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for i, obj in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % i + obj + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % o for o in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (
+        len(objects) + 1,
+        xref,
+    )
+    with open(path, "wb") as f:
+        f.write(out)
+
+
+def original(path, year=2025):
+    """parse_pdf and parse_menu as they were before extraction was parallel."""
+    text = ""
+    for page in PdfReader(path).pages:
+        text += page.extract_text() + "\n"
+
+    data = defaultdict(lambda: defaultdict(dict))
+    current_week = None
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        week_match = pdf2json.week_re.search(line)
+        if week_match:
+            current_week = int(week_match.group(1))
+            continue
+        day_match = pdf2json.day_re.match(line)
+        if day_match and current_week:
+            day_sv, date_str, dish_text = day_match.groups()
+            dish_text = re.sub(r"\s+", " ", dish_text)
+            dish_text = re.sub(r"\s+([,:;])", r"\1", dish_text)
+            data[str(year)][current_week][pdf2json.days_map[day_sv]] = dish_text.strip()
+    return data
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, default=120)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--filler", type=int, default=300, help="extra text runs per page")
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(prefix="skolmaten-bench-"), "menu.pdf")
+    make_pdf(path, args.pages, args.filler)
+    workers = args.workers or os.cpu_count()
+
+    start = time.perf_counter()
+    before = json.dumps(original(path), ensure_ascii=False, indent=2)
+    sequential = time.perf_counter() - start
+
+    def run(cache=False):
+        start = time.perf_counter()
+        result = json.dumps(
+            pdf2json.parse_menu(pdf2json.extract_pages(path, workers, cache)),
+            ensure_ascii=False,
+            indent=2,
+        )
+        return result, time.perf_counter() - start
+
+    after, parallel = run()
+    cache = pdfcache.Cache(os.path.join(os.path.dirname(path), "cache"))
+    cold = run(cache)
+    warm = run(cache)
+    make_pdf(path, args.pages + 1, args.filler)
+    revised = run(cache)
+
+    print(f"{args.pages} pages, {args.filler} filler runs each, {workers} workers")
+    print(f"  original   {sequential * 1000:8.1f} ms")
+    print(f"  pool       {parallel * 1000:8.1f} ms   {sequential / parallel:6.1f}x")
+    print(f"  output     {'identical' if before == after else 'DIFFERENT'}")
+    for label, (result, seconds) in [
+        ("cache cold", cold),
+        ("cache warm", warm),
+        ("+1 page", revised),
+    ]:
+        print(f"  {label:<10} {seconds * 1000:8.1f} ms   {sequential / seconds:6.1f}x")
+    print(f"  cached     {'identical' if cold[0] == warm[0] == after else 'DIFFERENT'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""SQL statements issued per db call, at two table sizes.
+
+The comment listings must cost the same number of statements no matter how
+many rows they return; a count that grows with the data means an N+1 lookup
+crept back in, and the script exits non-zero.
+
+    python -m benchmarks.queries
+"""
+
+import asyncio
+import sys
+
+from skolmaten import db
+
+from .common import make_app, seed_comments
+
+YEAR, WEEK = 2025, 10
+
+CALLS = {
+    "getcomments": lambda: db.getcomments(YEAR, WEEK, 0),
+    "getallcomments": db.getallcomments,
+    "comment_by_id": lambda: db.comment_by_id(0),
+    "get_author_by_comment_id": lambda: db.get_author_by_comment_id(0),
+    "get_week": lambda: db.get_week(YEAR, WEEK),
+    "get_comment_counts_year": lambda: db.get_comment_counts_year(YEAR),
+}
+
+
+def count(fn):
+    before = db.pool.stats()["queries"]
+    asyncio.run(fn())
+    return db.pool.stats()["queries"] - before
+
+
+def main():
+    make_app()
+    seed_comments(YEAR, [WEEK], per_day=1)
+    small = {name: count(fn) for name, fn in CALLS.items()}
+    seed_comments(YEAR, range(1, 53), per_day=20)
+    large = {name: count(fn) for name, fn in CALLS.items()}
+
+    failed = False
+    for name in CALLS:
+        flag = "" if small[name] == large[name] else "  <-- grows with rows"
+        failed |= bool(flag)
+        print(f"{name:>26}: {small[name]:3d} -> {large[name]:3d} statements{flag}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
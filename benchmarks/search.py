@@ -0,0 +1,68 @@
+"""Full-text search latency over a seeded database.
+
+Seeds --years of menus and --comments comments (see benchmarks.seed), then
+times db.search for a few dish and comment queries, best match first and
+newest first. Seeded comments are drawn from eight words, so each of them
+matches a large share of all comments: the worst case for ranking, which
+scores every match. The "fiskgratäng" comment query is the usual case.
+
+    python -m benchmarks.search
+    python -m benchmarks.search --years 10 --comments 200000
+"""
+
+import argparse
+import asyncio
+
+from skolmaten import db
+
+from . import seed
+from .common import make_app, timed
+
+REPEAT = 20
+QUERIES = [
+    ("dishes", "fiskgratäng"),
+    ("dishes", "kottbullar lingon"),
+    ("comments", "fiskgratäng"),
+    ("comments", "kallt"),
+    ("comments", "äckligt igen"),
+]
+
+
+async def matches(source, query):
+    table = "dishes_fts" if source == "dishes" else "comments_fts"
+    async with db.connect() as conn:
+        async with conn.execute(
+            f"SELECT COUNT(*) FROM {table} WHERE {table} MATCH ?",
+            (db.match_query(query),),
+        ) as cursor:
+            return (await cursor.fetchone())[0]
+
+
+async def complain(count):
+    for n in range(count):
+        await db.addcomment(2020, n % 52 + 1, n % 5, "Fiskgratängen var kall", 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--years", type=int, default=10)
+    parser.add_argument("--comments", type=int, default=100000)
+    args = parser.parse_args()
+
+    make_app()
+    asyncio.run(seed.seed(seed.scale(args.years, 100, args.comments)))
+    asyncio.run(complain(50))
+    print(f"{args.years} years, {args.comments} comments")
+
+    for source, query in QUERIES:
+        count = asyncio.run(matches(source, query))
+        ranked, _ = timed(lambda: db.search(query, source), REPEAT)
+        newest, _ = timed(lambda: db.search(query, source, newest=True), REPEAT)
+        print(
+            f"{source:>9} {query!r:<22} {count:7d} matches   "
+            f"ranked {ranked * 1000:6.2f} ms   newest {newest * 1000:6.2f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
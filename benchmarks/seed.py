@@ -0,0 +1,123 @@
+"""Synthetic data for load tests.
+
+Fills a database through the db module: menus via db.set_food_bulk, users
+and comments in large batches as one write on the db writer. Every user shares
+one real bcrypt hash of SEED_PASSWORD, so seeding thousands of users doesn't
+cost thousands of hashes but logging in as any of them still works.
+
+    python -m benchmarks.seed --years 10 --users 5000 --comments 500000 /tmp/database.db
+"""
+
+import argparse
+import asyncio
+import datetime
+import os
+import random
+
+from skolmaten import db
+
+SEED_PASSWORD = "benchpassword"
+BATCH = 5000
+
+DISHES = [
+    "Fiskgratäng med kokt potatis",
+    "Köttbullar med gräddsås och lingon",
+    "Pannkakor med sylt",
+    "Ärtsoppa och pannkakor",
+    "Kycklinggryta med ris",
+    "Vegetarisk lasagne",
+    "Falukorv med makaroner",
+    "Pytt i panna med rödbetor",
+    "Laxfilé med dillsås",
+    "Chili sin carne",
+]
+WORDS = ["gott", "äckligt", "kallt", "salt", "perfekt", "igen?", "mer sås", "bäst"]
+
+
+def scale(years=2, users=1000, comments=20000, first_year=None):
+    """Seed scale as a dict, so results can record what they ran against."""
+    first_year = first_year or datetime.date.today().year - years + 1
+    return {
+        "first_year": first_year,
+        "years": years,
+        "users": users,
+        "comments": comments,
+    }
+
+
+def year_weeks(first_year, years):
+    for year in range(first_year, first_year + years):
+        for week in range(1, datetime.date(year, 12, 28).isocalendar()[1] + 1):
+            yield year, week
+
+
+async def seed(scale, rng=None):
+    rng = rng or random.Random(0)
+    weeks = list(year_weeks(scale["first_year"], scale["years"]))
+
+    await db.set_food_bulk(
+        (year, week, day, rng.choice(DISHES))
+        for year, week in weeks
+        for day in range(1, 6)
+    )
+
+    hashed = await db.hash_password(SEED_PASSWORD)
+    await db.writer.write(_seed_rows, scale, weeks, hashed, rng)
+    return weeks
+
+
+def _seed_rows(conn, scale, weeks, hashed, rng):
+    # one writer job, so the whole seed is one transaction
+    first_user = (
+        conn.execute("SELECT COALESCE(MAX(id), -1) FROM users").fetchone()[0] + 1
+    )
+    for start in range(0, scale["users"], BATCH):
+        conn.executemany(
+            "INSERT INTO users (token, id, name, pass, authlvl, display) VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                ("", first_user + n, f"user{first_user + n}", hashed, 0, f"Elev {n}")
+                for n in range(start, min(start + BATCH, scale["users"]))
+            ],
+        )
+
+    first_comment = (
+        conn.execute("SELECT COALESCE(MAX(id), -1) FROM comments").fetchone()[0] + 1
+    )
+    authors = first_user + max(scale["users"], 1)
+    for start in range(0, scale["comments"], BATCH):
+        rows = []
+        for n in range(start, min(start + BATCH, scale["comments"])):
+            year, week = rng.choice(weeks)
+            rows.append(
+                (
+                    year,
+                    week,
+                    rng.randrange(5),
+                    first_comment + n,
+                    " ".join(rng.choices(WORDS, k=rng.randint(1, 6))),
+                    rng.randrange(authors),
+                )
+            )
+        conn.executemany(
+            "INSERT INTO comments (year, week, day, id, value, author) VALUES (?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("database")
+    parser.add_argument("--years", type=int, default=2)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--comments", type=int, default=20000)
+    args = parser.parse_args()
+
+    os.environ["DATABASE"] = args.database
+    from skolmaten import create_app
+
+    create_app()
+    asyncio.run(seed(scale(args.years, args.users, args.comments)))
+
+
+if __name__ == "__main__":
+    main()
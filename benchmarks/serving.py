@@ -0,0 +1,43 @@
+"""Requests per second and latency: WSGI (gunicorn sync) versus native ASGI.
+
+Both servers run one worker against the same seeded database; needs gunicorn
+and uvicorn installed.
+
+    python -m benchmarks.serving
+"""
+
+from .common import hammer, make_app, seed_comments, seed_week, serve
+
+CLIENTS = 16
+DURATION = 10.0
+PORT = 8765
+
+SERVERS = {
+    "wsgi (gunicorn sync)": f"gunicorn -w 1 -b 127.0.0.1:{PORT} skolmaten:create_app()",
+    "asgi (uvicorn)": f"uvicorn --factory skolmaten.asgi:create_asgi_app --port {PORT}",
+}
+
+
+def main():
+    app = make_app()
+    seed_week(2025, 10, comments_per_day=0)
+    seed_comments(2025, range(1, 53), per_day=10)
+    database = app.config["DATABASE"]
+
+    for name, command in SERVERS.items():
+        proc = serve(command.split(), PORT, database)
+        try:
+            rps, p50, p99, errors = hammer(
+                f"http://127.0.0.1:{PORT}/week/10?year=2025", CLIENTS, DURATION
+            )
+        finally:
+            proc.terminate()
+            proc.wait()
+        print(
+            f"{name:>22}: {rps:7.1f} req/s, p50 {p50 * 1000:7.1f} ms, "
+            f"p99 {p99 * 1000:7.1f} ms, {errors} errors"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+"""Week page data loading: per-day calls versus db.get_week.
+
+    python -m benchmarks.week
+"""
+
+from skolmaten import db
+
+from .common import make_app, seed_comments, seed_week, timed
+
+YEAR, WEEK = 2025, 10
+REPEAT = 20
+
+
+async def per_day():
+    # what week() used to do: two getcomments and one get_food per weekday
+    for day in range(5):
+        len(await db.getcomments(YEAR, WEEK, day))
+        len(await db.getcomments(YEAR, WEEK, day))
+        await db.get_food(YEAR, WEEK, day)
+
+
+async def one_shot():
+    await db.get_week(YEAR, WEEK)
+
+
+def main():
+    make_app()
+    seed_week(YEAR, WEEK, comments_per_day=0)
+    seed_comments(YEAR, range(1, 53), per_day=40)  # ~10k comments, 200 this week
+
+    for name, fn in [("per-day calls", per_day), ("get_week", one_shot)]:
+        latency, connects = timed(fn, REPEAT)
+        print(f"{name:>14}: {latency * 1000:8.2f} ms, {connects:6.1f} connections")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,4 +2,11 @@
 docker stop skolmaten
 docker rm skolmaten
 docker build -t skolmaten .
-docker run -d -p 8000:8000 -v ./database.db:/app/database.db --name skolmaten skolmaten
+# the database runs in WAL mode, which keeps database.db-wal and -shm next to
+# it, so the directory is mounted rather than the file; a database from the
+# old single-file mount is moved in the first time
+mkdir -p data
+if [ -f database.db ] && [ ! -e data/database.db ]; then
+    mv database.db data/database.db
+fi
+docker run -d -p 8000:8000 -v ./data:/app/data -e DATABASE=/app/data/database.db --user "$(id -u):$(id -g)" --name skolmaten skolmaten
@@ -14,17 +14,47 @@ def create_app():
         static_folder="../static/",
         static_url_path=os.environ.get("ROOT", "/") + "static",
     )
-    app.config.from_mapping(DATABASE="database.db")
+    app.config.from_mapping(
+        DATABASE=os.environ.get("DATABASE", "database.db"),
+        DATABASE_POOL_SIZE=int(os.environ.get("DATABASE_POOL_SIZE", 8)),
+        TOKEN_CACHE_SIZE=int(os.environ.get("TOKEN_CACHE_SIZE", 1024)),
+        TOKEN_CACHE_TTL=float(os.environ.get("TOKEN_CACHE_TTL", 30)),
+        WRITE_BATCH_WINDOW_MS=float(os.environ.get("WRITE_BATCH_WINDOW_MS", 0)),
+        WRITE_BATCH_SIZE=int(os.environ.get("WRITE_BATCH_SIZE", 256)),
+        WAL_LIMIT_MB=int(os.environ.get("WAL_LIMIT_MB", 64)),
+        HASH_WORKERS=int(os.environ.get("HASH_WORKERS", 2)),
+        HASH_QUEUE=int(os.environ.get("HASH_QUEUE", 16)),
+        METRICS_DIR=os.environ.get("METRICS_DIR"),
+        METRICS_TOKEN=os.environ.get("METRICS_TOKEN"),
+        SERVER_TIMING=os.environ.get("SERVER_TIMING", "0") == "1",
+        SLOW_QUERY_MS=float(os.environ.get("SLOW_QUERY_MS", 100)),
+        SLOW_QUERY_LOG=os.environ.get("SLOW_QUERY_LOG"),
+        PRERENDER_DIR=os.environ.get("PRERENDER_DIR"),
+        PRERENDER_URL=os.environ.get("PRERENDER_URL"),
+        PRERENDER_WEEKS=int(os.environ.get("PRERENDER_WEEKS", 4)),
+        PRERENDER_INTERVAL=float(os.environ.get("PRERENDER_INTERVAL", 5)),
+        ASSET_BUILD_DIR=os.environ.get(
+            "ASSET_BUILD_DIR", os.path.join(app.static_folder, "build")
+        ),
+    )
     app.secret_key = uuid.uuid4().hex
     app.json.sort_keys = False
     app.config["APPLICATION_ROOT"] = config.get("ROOT", "/")
 
     from . import db
 
-    db.init_app()
+    db.init_app(app)
 
     from . import app as main_routes
 
     app.register_blueprint(main_routes.app, url_prefix=app.config["APPLICATION_ROOT"])
 
+    from . import assets
+
+    assets.init_app(app)
+
+    from . import prerender
+
+    prerender.init_app(app)
+
     return app
@@ -1,4 +1,6 @@
 import datetime
+import hashlib
+import hmac
 import json
 import os
 import re
@@ -7,6 +9,8 @@ import time
 from flask import (
     Blueprint,
     Response,
+    current_app,
+    g,
     make_response,
     redirect,
     render_template,
@@ -14,8 +18,10 @@ from flask import (
     session,
     url_for,
 )
+from markupsafe import Markup
 
-from . import db
+from . import assets, db, foodjson, metrics, prerender
+from .cache import MISSING, TTLCache
 
 app = Blueprint(
     "main", __name__, static_url_path=os.environ.get("ROOT", "/") + "static"
@@ -24,7 +30,10 @@ os.environ["TZ"] = "Europe/London"
 time.tzset()
 
 weekdays = ["mån", "tis", "ons", "tor", "fre"]
-weekdays_en = ["mon", "tue", "wed", "thu", "fri"]
+
+# rendered menus keyed by route, arguments, viewer role and data version;
+# stale versions are never looked up again and age out of the LRU
+page_cache = TTLCache(maxsize=512, ttl=3600)
 
 http_errors = {
     400: "Bad Request",
@@ -32,12 +41,31 @@ http_errors = {
     403: "Forbidden",
     404: "Not Found",
     500: "Internal Server Error",
+    503: "Service Unavailable",
     # Custom error codes for this project
     2001: "Invalid username or password",
     2002: "Resource not found",
 }
 
 
+@app.before_request
+def start_metrics():
+    g.metrics = metrics.start_request()
+
+
+@app.after_request
+def finish_metrics(resp):
+    if "metrics" not in g:
+        return resp
+    return metrics.finish_request(
+        g.pop("metrics"),
+        request.endpoint,
+        request.method,
+        resp,
+        current_app.config.get("SERVER_TIMING", False),
+    )
+
+
 def week_mon2sun(year, week):
     r = [
         datetime.datetime.fromisocalendar(year, week, 1),
@@ -69,10 +97,19 @@ async def root():
     return await week(curweek)
 
 
+async def principal(token):
+    """The user behind `token`, looked up at most once per request."""
+    if token is None:
+        return None
+    if "principal" not in g or g.principal[0] != token:
+        g.principal = (token, await db.user_by_token(token))
+    return g.principal[1]
+
+
 async def hasperms(token, perms):
     if token is None:
         return False
-    info: dict = await db.user_by_token(token)
+    info: dict = await principal(token)
     if not info:
         return False
     if info["auth"] >= perms:
@@ -80,44 +117,40 @@ async def hasperms(token, perms):
     return False
 
 
-# for dynamic urls in css (used for font)
+# unfingerprinted stylesheet for old cached pages; rendered once by assets.init_app
 @app.route("/static/style.css")
 def dynamic_css():
-    css = render_template("style.css")
-    return Response(css, mimetype="text/css")
+    return Response(assets.assets["style.css"].data, mimetype="text/css")
 
 
-@app.route("/week/<int:week>")
-async def week(week):
-    baseurl = request.url_root + url_for("main.root")[1:]
-    year = request.args.get("year", type=int, default=datetime.datetime.now().year)
-    curweek, curyear = calculate_closest_week()
-    token = request.cookies.get("token")
-    if is_week_in_next_year(year, week):
-        return redirect(url_for("main.week", week=1, year=year + 1))
-    if week <= 0:
-        return redirect(
-            url_for(
-                "main.week",
-                week=datetime.date(year - 1, 12, 28).isocalendar()[1],
-                year=year - 1,
-            )
-        )
-    monday = datetime.datetime.fromisocalendar(year, week, 1)
+@app.route("/assets/<name>")
+def asset(name):
+    resp = assets.response(name)
+    if resp is None:
+        return errorpage(404), 404
+    return resp
 
+
+async def dashboard(token, year, users_version):
+    """Links and user list for the controls panel shown next to every menu."""
+    curweek, curyear = calculate_closest_week()
     links = [
         f"login - Logga in",
         f"register - Registrera nytt konto",
         f"week/{curweek}?year={curyear} - Matsedel för vecka {curweek}",
         f"year/{year} - Matsedel för år {year}",
+        f"search - Sök i matsedlar och kommentarer",
     ]
-    i = await db.id_by_token(str(token))
+    user = await principal(token)
+    i = user["id"] if user is not None else None
     if await hasperms(token, 2):
-        userdict = await db.get_all_users()
+        userdict = await cached(
+            ("users",), {"users": users_version}, db.get_all_users
+        )
     elif i is None:
         userdict = [{"name": "null", "auth": -1, "id": -1, "display": "Null"}]
     elif token is not None:
-        userdict = [await db.user_by_id(int(i))]
+        userdict = [user]
         i = 0
     else:
         userdict = []  # should never happen but just in case
@@ -132,98 +165,191 @@ async def week(week):
     if await hasperms(token, 1):
         links.append(f"mgr/food/import - Importera matsedel från JSON")
 
-    comlen = [
-        (
-            "9+"
-            if len(await db.getcomments(year, week, i)) >= 10
-            else len(await db.getcomments(year, week, i))
+    return links, userdict, i if i is not None else -1
+
+
+async def cached(key, versions, render):
+    """Return `await render()`, reusing the result while `versions` are unchanged.
+
+    `versions` comes from db.get_versions, so a write in any worker makes
+    every worker render afresh.
+    """
+    key = (*key, *sorted(versions.items()))
+    value = page_cache.get(key)
+    if value is MISSING:
+        value = await render()
+        page_cache.set(key, value)
+    return value
+
+
+def last_week_rollover():
+    """When calculate_closest_week() last changed its answer (friday noon)."""
+    now = datetime.datetime.now()
+    friday = (now - datetime.timedelta(days=(now.weekday() - 4) % 7)).replace(
+        hour=12, minute=0, second=0, microsecond=0
+    )
+    if friday > now:
+        friday -= datetime.timedelta(days=7)
+    return friday.timestamp()
+
+
+async def validators(versions, viewer=True):
+    """Strong ETag and Last-Modified for a response built from `versions`.
+
+    Pages with the controls panel also depend on who is looking and on
+    which week is the current one, so `viewer` folds those in as well.
+    """
+    parts = [request.full_path, sorted(versions.items())]
+    modified = max(m for _, m in versions.values())
+    if viewer:
+        user = await principal(request.cookies.get("token"))
+        parts += [
+            request.url_root,
+            calculate_closest_week(),
+            user and (user["id"], user["auth"]),
+        ]
+        modified = max(modified, last_week_rollover())
+    etag = hashlib.sha256(repr(parts).encode()).hexdigest()[:32]
+    return etag, datetime.datetime.fromtimestamp(int(modified), datetime.timezone.utc)
+
+
+def not_modified(etag, modified):
+    """A 304 response if the client's copy is still current, otherwise None."""
+    if request.if_none_match:
+        fresh = request.if_none_match.contains(etag)
+    else:
+        since = request.if_modified_since
+        fresh = since is not None and modified <= since
+    if not fresh:
+        return None
+    return with_validators(Response(status=304), etag, modified)
+
+
+def with_validators(rv, etag, modified):
+    resp = make_response(rv)
+    resp.set_etag(etag)
+    resp.last_modified = modified
+    resp.vary.add("Cookie")
+    return resp
+
+
+@app.route("/week/<int:week>")
+async def week(week):
+    baseurl = request.url_root + url_for("main.root")[1:]
+    year = request.args.get("year", type=int, default=datetime.datetime.now().year)
+    token = request.cookies.get("token")
+    if is_week_in_next_year(year, week):
+        return redirect(url_for("main.week", week=1, year=year + 1))
+    if week <= 0:
+        return redirect(
+            url_for(
+                "main.week",
+                week=datetime.date(year - 1, 12, 28).isocalendar()[1],
+                year=year - 1,
+            )
         )
-        for i in range(5)
-    ]
-    foodplan = []
-    for weekday in range(5):
-        foodplan.append(
+
+    key = db.week_key(year, week)
+    versions = await db.get_versions(key, "users")
+    etag, modified = await validators(versions)
+    if (resp := not_modified(etag, modified)) is not None:
+        return resp
+
+    links, userdict, loginid = await dashboard(token, year, versions["users"])
+    canedit = await hasperms(token, 2)
+
+    async def render():
+        days = await db.get_week(year, week)
+        comlen = ["9+" if d["comments"] >= 10 else d["comments"] for d in days]
+        foodplan = [
             [
                 url_for(
-                    "main.editfoodforday", year=year, week=week, weekday=weekday + 1
+                    "main.editfoodforday", year=year, week=week, weekday=d["day"] + 1
                 ),
-                await db.get_food(year, week, weekday),
+                d["text"],
             ]
+            for d in days
+        ]
+        return Markup(
+            render_template(
+                "weekmenu.html",
+                year=year,
+                week=week,
+                weekday=weekdays,
+                canedit=canedit,
+                baseurl=baseurl,
+                str=str,
+                datetime=datetime.datetime,
+                weekdata=datetime.datetime.fromisocalendar(year, week, 1),
+                schema=foodplan,
+                comlen=comlen,
+            )
         )
 
-    return render_template(
-        "week.html",
-        year=year,
-        week=week,
-        weekday=weekdays,
-        curweek=curweek,
-        userdict=userdict,
-        loginid=i if i is not None else -1,
-        baseurl=baseurl,
-        str=str,
-        list=list,
-        int=int,
-        datetime=datetime.datetime,
-        weekdata=monday,
-        schema=foodplan,
-        comlen=comlen,
-        links=links,
+    menu = await cached(
+        ("week", year, week, canedit, baseurl), {key: versions[key]}, render
+    )
+
+    return with_validators(
+        render_template(
+            "week.html",
+            week=week,
+            menu=menu,
+            userdict=userdict,
+            loginid=loginid,
+            baseurl=baseurl,
+            links=links,
+        ),
+        etag,
+        modified,
     )
 
 
 @app.route("/year/<int:year>")
 async def yearplan(year):
     baseurl = request.url_root + url_for("main.root")[1:]
-    curweek, curyear = calculate_closest_week()
     token = request.cookies.get("token")
 
-    links = [
-        "login - Logga in",
-        "register - Registrera nytt konto",
-        f"week/{curweek}?year={curyear} - Matsedel för vecka {curweek}",
-        f"year/{year} - Matsedel för år {year}",
-    ]
-
-    i = await db.id_by_token(str(token))
-    if await hasperms(token, 2):
-        userdict = await db.get_all_users()
-    elif i is None:
-        userdict = [{"name": "null", "auth": -1, "id": -1, "display": "Null"}]
-    elif token is not None:
-        userdict = [await db.user_by_id(int(i))]
-        i = 0
-    else:
-        userdict = []
-
-    if token and (i is not None):
-        links.append(f"mgr/edtpwd/{i} - Ändra lösenord")
-        links.insert(1, "logout - Logga ut")
-        links.append(f"mgr/edtdsp/{i} - Byt namn")
-    if await hasperms(token, 1):
-        links.append(f"mgr/food/import - Importera matsedel från JSON")
+    key = db.year_key(year)
+    versions = await db.get_versions(key, "users")
+    etag, modified = await validators(versions)
+    if (resp := not_modified(etag, modified)) is not None:
+        return resp
+
+    links, userdict, loginid = await dashboard(token, year, versions["users"])
+    canedit = await hasperms(token, 2)
+
+    async def render():
+        return Markup(
+            render_template(
+                "yearmenu.html",
+                year=year,
+                weekday=weekdays,
+                schema=await db.get_food_year(year),
+                canedit=canedit,
+                baseurl=baseurl,
+                str=str,
+                datetime=datetime.datetime,
+                comlen=await db.get_comment_counts_year(year),
+            )
+        )
 
-    comlen = []
-    for week in range(1, 53):  # ISO weeks are 1–52 (or 53)
-        week_counts = []
-        for day in range(5):  # Mon–Fri
-            comments = await db.getcomments(year, week, day)
-            week_counts.append(len(comments))
-        comlen.append(week_counts)
+    menu = await cached(
+        ("year", year, canedit, baseurl), {key: versions[key]}, render
+    )
 
-    return render_template(
-        "year.html",
-        year=year,
-        weekday=weekdays,
-        schema=await db.get_food_year(year),
-        links=links,
-        userdict=userdict,
-        loginid=i if i is not None else -1,
-        baseurl=baseurl,
-        str=str,
-        list=list,
-        datetime=datetime.datetime,
-        comlen=comlen,
-        usercount=range(len(userdict)),
+    return with_validators(
+        render_template(
+            "year.html",
+            year=year,
+            menu=menu,
+            userdict=userdict,
+            loginid=loginid,
+            baseurl=baseurl,
+            links=links,
+        ),
+        etag,
+        modified,
     )
 
 
@@ -257,6 +383,8 @@ async def login():
                 ),
             )
             return resp
+        except db.Overloaded as e:
+            return olderrorpage(503, str(e))
         except Exception as e:
             return olderrorpage(403, "Forbidden: Invalid Credentials")
     return render_template("login.html")
@@ -288,6 +416,8 @@ async def register():
                 ),
             )  # log in after registering
             return resp
+        except db.Overloaded as e:
+            return olderrorpage(503, str(e))
         except Exception as e:
             return olderrorpage(403, "Forbidden: Invalid Credentials " + str(e))
     return render_template("register.html")
@@ -298,7 +428,8 @@ async def revoke_token(id):
     token = request.cookies.get("token", None)
     if token is None:
         return olderrorpage(401, "Ej Inloggad")
-    mid = await db.id_by_token(token)  # my id
+    me = await principal(token)
+    mid = me["id"] if me is not None else None  # my id
     if mid is None:
         return olderrorpage(403, "Invalid inloggning")
     if await hasperms(token, 2) or mid == id:
@@ -313,8 +444,8 @@ async def delete_account(id):
     token = request.cookies.get("token", None)
     if token is None:
         return olderrorpage(403, "Unauthorized")
-    info = await db.id_by_token(token)
-    if await hasperms(token, 2) or info == id:
+    me = await principal(token)
+    if await hasperms(token, 2) or (me is not None and me["id"] == id):
         await db.delete_account(id)
         return redirect(url_for("main.root"))
     return {"Status": "Failed.", "Reason": "Unauthorized."}
@@ -327,7 +458,7 @@ async def edit_display_name(id):
             token = request.cookies.get("token", None)
             if token is None:
                 raise olderrorpage(401, "Unauthorized")
-            info = await db.user_by_token(token)
+            info = await principal(token)
             if await hasperms(token, 2) or info["id"] == id:
                 await db.changedisplay(id, request.form.get("display"))
 
@@ -343,7 +474,7 @@ async def edit_login(id):
         token = request.cookies.get("token", None)
         if token is None:
             olderrorpage(401, "Unauthorized")
-        info = await db.user_by_token(token)
+        info = await principal(token)
         if await hasperms(token, 2) or info["id"] == id:
             await db.editlogin(id, request.form.get("display"))
 
@@ -357,10 +488,9 @@ async def edit_permission(id: int, permlevel: int):
     token = request.cookies.get("token", None)
     if token is None:
         return olderrorpage(401, "Not logged in")
-    mid = await db.id_by_token(token)
-    if mid is None:
+    info = await principal(token)
+    if info is None:
         return olderrorpage(401, "Invalid Token")
-    info = await db.user_by_id(mid)
     permission = info["auth"]
     if permission >= int(db.AuthLevels.Moderator.value):
         if permlevel >= permission:
@@ -373,6 +503,31 @@ async def edit_permission(id: int, permlevel: int):
     return olderrorpage(403, "Invalid Permissions")
 
 
+@app.route("/mgr/stats")
+async def stats():
+    if not await hasperms(request.cookies.get("token"), 2):
+        return olderrorpage(403, "Invalid Permissions")
+    return {
+        "pool": db.pool.stats(),
+        "writer": db.writer.stats(),
+        "menus": db.menus.stats(),
+        "token_cache": db.users_by_token.stats(),
+        "hasher": db.hasher.stats(),
+        "prerender": prerender.prerenderer and prerender.prerenderer.stats(),
+    }
+
+
+@app.route("/metrics")
+def prometheus_metrics():
+    # scrapers can't log in, so this is guarded by its own bearer token if set
+    expected = current_app.config.get("METRICS_TOKEN")
+    if expected:
+        given = request.headers.get("Authorization", "").removeprefix("Bearer ")
+        if not hmac.compare_digest(given.encode(), expected.encode()):
+            return olderrorpage(401, "Unauthorized")
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
 @app.route("/mgr/edtpwd/<int:id>", methods=["GET", "POST"])
 async def edit_password(id):
     if request.method == "POST":
@@ -381,6 +536,8 @@ async def edit_password(id):
                 id, request.form["oldpassword"], request.form["newpassword"]
             )
             return redirect(url_for("main.root"))
+        except db.Overloaded as e:
+            return olderrorpage(503, str(e))
         except Exception as e:
             return olderrorpage(400, str(e))
     return render_template("changepassword.html")
@@ -432,19 +589,8 @@ async def importfoodjson():
             if not file:
                 return olderrorpage(400, "No file uploaded")
 
-            j = json.load(file.stream)
-            for year, weeks in j.items():
-                for week, days in weeks.items():
-                    for day, value in days.items():
-                        day_short = day[
-                            :3
-                        ].lower()  # truncate to 3 letters, just in case so the app doesnt shit itself
-                        if day_short not in weekdays_en:
-                            continue
-                        weekday = weekdays_en.index(day_short) + 1
-                        await db.set_food(year, week, weekday, value)
-
-            return redirect(url_for("main.root"))
+            summary = await db.set_food_bulk(foodjson.iter_food_json(file.stream))
+            return render_template("import.html", summary=summary)
 
         except Exception as e:
             return {"error": f"Failed to import food: {str(e)}"}, 500
@@ -454,12 +600,17 @@ async def importfoodjson():
 
 @app.route("/comments/day/<int:year>/<int:week>/<int:weekday>")
 async def comments(year, week, weekday):
+    versions = await db.get_versions(db.week_key(year, week), "users")
+    etag, modified = await validators(versions)
+    if (resp := not_modified(etag, modified)) is not None:
+        return resp
+
     commlist = await db.getcomments(year, week, weekday)
     token = request.cookies.get("token")
     hasperm = await hasperms(token, 0)
     ismod = await hasperms(token, 2)
     session["back"] = request.url
-    return render_template(
+    page = render_template(
         "comments.html",
         timestr=datetime.datetime.fromisocalendar(year, week, weekday + 1).strftime(
             "%a %d %b"
@@ -471,12 +622,69 @@ async def comments(year, week, weekday):
         hasperm=hasperm,
         ismod=ismod,
     )
+    return with_validators(page, etag, modified)
 
 
 @app.route("/comments/all")
 async def allcomments():
-    commlist = await db.getallcomments()
-    return commlist
+    versions = await db.get_versions("comments", "users")
+    etag, modified = await validators(versions, viewer=False)
+    if (resp := not_modified(etag, modified)) is not None:
+        return resp
+
+    after = request.args.get("after", -1, type=int)
+    if request.args.get("format") == "ndjson":
+        fetch = current_app.ensure_sync(db.comments_page)
+
+        def stream(after):
+            # one keyset page in memory at a time, however big the table is
+            while page := fetch(after, 500):
+                for comment in page:
+                    yield json.dumps(comment, ensure_ascii=False) + "\n"
+                after = page[-1]["id"]
+
+        resp = Response(stream(after), mimetype="application/x-ndjson")
+        return with_validators(resp, etag, modified)
+
+    if "after" not in request.args and "limit" not in request.args:
+        # the original everything-at-once listing
+        return with_validators(await db.getallcomments(), etag, modified)
+
+    limit = min(max(request.args.get("limit", 100, type=int), 1), 1000)
+    page = await db.comments_page(after, limit)
+    body = {
+        "comments": page,
+        "next": page[-1]["id"] if len(page) == limit else None,
+    }
+    return with_validators(body, etag, modified)
+
+
+@app.route("/search")
+async def search():
+    query = request.args.get("q", "").strip()
+    source = request.args.get("source", "dishes")
+    if source not in ("dishes", "comments"):
+        return olderrorpage(400, "Unknown source")
+    order = request.args.get("order", "rank")
+    offset = max(request.args.get("offset", 0, type=int), 0)
+    limit = min(max(request.args.get("limit", 20, type=int), 1), 100)
+
+    hits = await db.search(query, source, limit, offset, newest=order == "newest")
+    next = offset + limit if len(hits) == limit else None
+    if request.args.get("format") == "json":
+        return {"hits": hits, "next": next}
+    return render_template(
+        "search.html",
+        query=query,
+        source=source,
+        order=order,
+        newest=order == "newest",
+        hits=hits,
+        offset=offset,
+        limit=limit,
+        next=next,
+        weekday=weekdays,
+    )
 
 
 @app.route("/comments/add/<int:year>/<int:week>/<int:weekday>", methods=["POST"])
@@ -485,7 +693,7 @@ async def addcomment(year, week, weekday):
         token = request.cookies.get("token")
         if not token:
             return olderrorpage(401, "Not logged in")
-        info = await db.user_by_token(token)
+        info = await principal(token)
         if info is None:
             return olderrorpage(403, "Unauthorized")
         value = str(request.form.get("value", "")).strip()
@@ -498,7 +706,7 @@ async def addcomment(year, week, weekday):
 @app.route("/comments/del/<int:id>")
 async def delcomment(id):
     token = request.cookies.get("token")
-    info = await db.user_by_token(token)
+    info = await principal(token)
     if not token:
         return olderrorpage(401, "Unauthorized")
     user = (await db.get_author_by_comment_id(id)).split(":")[0]
@@ -0,0 +1,172 @@
+"""Native ASGI entry point.
+
+Under gunicorn's sync workers every async view gets a fresh event loop in a
+helper thread. This serves the same app, blueprint and templates from one
+long-lived event loop per worker instead, so async views are awaited
+directly and the connection pool, caches and hasher are shared by every
+request the worker handles:
+
+    uvicorn --factory skolmaten.asgi:create_asgi_app
+    gunicorn -w 4 -k uvicorn.workers.UvicornWorker 'skolmaten.asgi:create_asgi_app()'
+"""
+
+import asyncio
+import inspect
+import sys
+import tempfile
+
+from flask import request, request_started
+
+from . import create_app, db
+
+
+# request bodies up to this size are kept in memory, larger ones on disk
+BODY_SPOOL_BYTES = 1 << 20
+
+
+def build_environ(scope, body) -> dict:
+    """Translate an ASGI HTTP scope and its body, a binary file positioned
+    at its start, into a WSGI environ."""
+    script_name = scope.get("root_path", "").encode("utf8").decode("latin1")
+    path_info = scope["path"].encode("utf8").decode("latin1")
+    if path_info.startswith(script_name):
+        path_info = path_info[len(script_name) :]
+    server = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": script_name,
+        "PATH_INFO": path_info,
+        "QUERY_STRING": scope["query_string"].decode("latin1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope['http_version']}",
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": body,
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    if scope.get("client"):
+        environ["REMOTE_ADDR"] = scope["client"][0]
+    for name, value in scope.get("headers", []):
+        name = name.decode("latin1")
+        if name == "content-length":
+            key = "CONTENT_LENGTH"
+        elif name == "content-type":
+            key = "CONTENT_TYPE"
+        else:
+            key = "HTTP_" + name.upper().replace("-", "_")
+        value = value.decode("latin1")
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+class ASGIApp:
+    """Runs a Flask app's views on the server's event loop.
+
+    This is Flask's own full_dispatch_request with the view, and any async
+    request_started receivers, awaited instead of being handed to
+    async_to_sync.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+        elif scope["type"] == "http":
+            await self.http(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await asyncio.to_thread(db.writer.close)
+                await db.pool.close()
+                db.hasher.shutdown()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def http(self, scope, receive, send):
+        # spooled, so a large upload like a food JSON import goes to disk
+        # instead of being held in memory whole
+        with tempfile.SpooledTemporaryFile(BODY_SPOOL_BYTES) as body:
+            while True:
+                message = await receive()
+                body.write(message.get("body", b""))
+                if not message.get("more_body"):
+                    break
+            body.seek(0)
+            response = await self.handle(build_environ(scope, body))
+
+        await send(
+            {
+                "type": "http.response.start",
+                "status": response.status_code,
+                "headers": [
+                    (name.lower().encode("latin1"), value.encode("latin1"))
+                    for name, value in response.headers.items()
+                ],
+            }
+        )
+        if response.is_sequence:
+            await send({"type": "http.response.body", "body": response.get_data()})
+            return
+        # streamed bodies may block (files) or bridge back into async code
+        # themselves, so they are pulled from a worker thread
+        chunks = iter(response.iter_encoded())
+        try:
+            while (chunk := await asyncio.to_thread(next, chunks, None)) is not None:
+                await send(
+                    {"type": "http.response.body", "body": chunk, "more_body": True}
+                )
+        finally:
+            response.close()
+        await send({"type": "http.response.body", "body": b""})
+
+    async def handle(self, environ):
+        app = self.app
+        app._got_first_request = True
+        with app.request_context(environ):
+            try:
+                try:
+                    await request_started.send_async(app, _sync_wrapper=_awaitable)
+                    rv = app.preprocess_request()
+                    if rv is None:
+                        rv = await self.dispatch()
+                except Exception as e:
+                    rv = app.handle_user_exception(e)
+                return app.finalize_request(rv)
+            except Exception as e:
+                return app.handle_exception(e)
+
+    async def dispatch(self):
+        app = self.app
+        if request.routing_exception is not None:
+            app.raise_routing_exception(request)
+        rule = request.url_rule
+        if (
+            getattr(rule, "provide_automatic_options", False)
+            and request.method == "OPTIONS"
+        ):
+            return app.make_default_options_response()
+        view = app.view_functions[rule.endpoint]
+        rv = view(**request.view_args)
+        return await rv if inspect.isawaitable(rv) else rv
+
+
+def _awaitable(fn):
+    # blinker awaits every receiver; the sync ones just run inline
+    async def call(*args, **kwargs):
+        return fn(*args, **kwargs)
+
+    return call
+
+
+def create_asgi_app():
+    return ASGIApp(create_app())
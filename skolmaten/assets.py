@@ -0,0 +1,133 @@
+"""Fingerprinted, precompressed static assets.
+
+At startup every file in static/ and the rendered style.css get a name with
+a content hash in it (style.3f2a9c1b0d4e.css), so they can be served with
+`Cache-Control: immutable` and repeat visitors never ask for them again.
+Compressible assets also get gzip and brotli variants. Those are written to
+ASSET_BUILD_DIR so the gunicorn workers compress each version of a file only
+once between them.
+"""
+
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+import tempfile
+
+import brotli
+from flask import Response, render_template, request, url_for
+
+logger = logging.getLogger(__name__)
+# directories write_atomic has warned about already
+_unwritable: set[str] = set()
+
+# immutable assets never change under a given name, so cache them for a year
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+# already compressed formats gain nothing from another pass
+COMPRESSIBLE = {".css", ".ttf", ".svg", ".js", ".txt"}
+
+
+class Asset:
+    def __init__(self, name: str, data: bytes):
+        self.name = name
+        self.data = data
+        self.digest = hashlib.sha256(data).hexdigest()
+        stem, ext = os.path.splitext(name)
+        self.hashed = f"{stem}.{self.digest[:12]}{ext}"
+        self.mimetype = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        self.encodings = {}  # "gzip"/"br" -> compressed bytes
+
+    def compress(self, build_dir: str):
+        if os.path.splitext(self.name)[1] not in COMPRESSIBLE:
+            return
+        compressors = {
+            "gzip": lambda d: gzip.compress(d, 9, mtime=0),
+            "br": lambda d: brotli.compress(d, quality=11),
+        }
+        for encoding, compress in compressors.items():
+            suffix = ".gz" if encoding == "gzip" else ".br"
+            path = os.path.join(build_dir, self.hashed + suffix)
+            try:
+                with open(path, "rb") as f:
+                    self.encodings[encoding] = f.read()
+                continue
+            except OSError:
+                pass
+            data = compress(self.data)
+            self.encodings[encoding] = data
+            write_atomic(path, data)
+
+
+def write_atomic(path: str, data: bytes):
+    """Write so that a worker reading concurrently never sees half a file."""
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except OSError as e:
+        # a read-only checkout just compresses in every worker, so say so
+        # once per directory rather than for every file
+        directory = os.path.dirname(path)
+        if directory not in _unwritable:
+            _unwritable.add(directory)
+            logger.warning("can't write to %s: %s", directory, e)
+
+
+# original name -> Asset, and hashed name -> Asset
+assets: dict[str, Asset] = {}
+by_hash: dict[str, Asset] = {}
+
+
+def asset_url(name: str) -> str:
+    """URL of the current version of static file `name`."""
+    asset = assets.get(name)
+    if asset is None:
+        return url_for("static", filename=name)
+    return url_for("main.asset", name=asset.hashed)
+
+
+def add(name: str, data: bytes, build_dir: str):
+    asset = Asset(name, data)
+    asset.compress(build_dir)
+    assets[name] = asset
+    by_hash[asset.hashed] = asset
+
+
+def init_app(app):
+    """Fingerprint static/ and render style.css once for this process."""
+    build_dir = app.config.get(
+        "ASSET_BUILD_DIR", os.path.join(app.static_folder, "build")
+    )
+    app.jinja_env.globals["asset_url"] = asset_url
+
+    for entry in sorted(os.scandir(app.static_folder), key=lambda e: e.name):
+        if entry.is_file():
+            with open(entry.path, "rb") as f:
+                add(entry.name, f.read(), build_dir)
+
+    # the stylesheet links to the font, so it is rendered after the font has
+    # its final name
+    with app.test_request_context(base_url="http://localhost/"):
+        css = render_template("style.css").encode()
+    add("style.css", css, build_dir)
+
+
+def response(name: str):
+    asset = by_hash.get(name)
+    if asset is None:
+        return None
+    accepted = request.accept_encodings
+    for encoding in ("br", "gzip"):
+        if encoding in asset.encodings and accepted[encoding]:
+            resp = Response(asset.encodings[encoding], mimetype=asset.mimetype)
+            resp.content_encoding = encoding
+            break
+    else:
+        resp = Response(asset.data, mimetype=asset.mimetype)
+    resp.headers["Cache-Control"] = CACHE_CONTROL
+    resp.vary.add("Accept-Encoding")
+    resp.set_etag(asset.digest[:32])
+    return resp.make_conditional(request)
@@ -0,0 +1,47 @@
+"""Check the tables the triggers maintain against what they are built from.
+
+Compares comment_counts with a fresh count of the comments table and lists
+every day where they disagree, exiting non-zero if any do. `--repair`
+rebuilds comment_counts from the comments in one write.
+
+    python -m skolmaten.consistency
+    python -m skolmaten.consistency --repair --database /app/data/database.db
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+
+from . import create_app, db
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database", help="defaults to $DATABASE or database.db")
+    parser.add_argument(
+        "--repair", action="store_true", help="rebuild comment_counts if it is off"
+    )
+    args = parser.parse_args()
+
+    if args.database:
+        os.environ["DATABASE"] = args.database
+
+    create_app()
+    mismatches = asyncio.run(db.comment_count_mismatches())
+    for year, week, day, counted, stored in mismatches:
+        print(
+            f"{year} v.{week:<2} {db.weekdays[day] if 0 <= day < 5 else day}  "
+            f"{stored} stored, {counted} comments"
+        )
+    print(f"comment_counts: {len(mismatches)} days off")
+
+    if mismatches and args.repair:
+        asyncio.run(db.rebuild_comment_counts())
+        mismatches = asyncio.run(db.comment_count_mismatches())
+        print(f"rebuilt, {len(mismatches)} days off")
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
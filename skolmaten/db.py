@@ -1,14 +1,43 @@
 import asyncio
+import atexit
 import datetime
+import itertools
+import re
+import sys
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
 
-import aiosqlite
-from jose.jwt import decode, encode
+from jose.jwt import encode
 from passlib.context import CryptContext
 
+from . import metrics, migrations, slowlog
+from .cache import MISSING, TTLCache
+from .hashing import Hasher, Overloaded
+from .menus import MenuStore
+from .pool import Pool, VersionWatch, Writer, shutdown
+
 secret = uuid.uuid4().hex
 
+pool: Pool | None = None
+
+# every write goes through this; see Writer
+writer: Writer | None = None
+
+# what get_food, get_week and get_food_year read menus from
+menus: MenuStore | None = None
+
+# token -> (version of the user's row, user dict or None for unknown
+# tokens); see user_by_token and forget_user
+users_by_token = TTLCache()
+
+# the "user:<id>" versions, bumped whenever a user is renamed, demoted,
+# deleted or has their token revoked (migration 9), so lookups cached before
+# that in any worker are stale
+user_versions: VersionWatch | None = None
+
+hasher = Hasher()
+
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
@@ -24,21 +53,29 @@ class AuthLevels(Enum):
 weekdays = ["mon", "tue", "wed", "thu", "fri"]
 
 
-def hash_password(password: str) -> str:
+async def hash_password(password: str) -> str:
     """Hash a password with a salt."""
-    return pwd_context.hash(password)
+    return await hasher.run(pwd_context.hash, password)
 
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Verify a plain password against a hashed password."""
-    return pwd_context.verify(plain_password, hashed_password)
+def connect():
+    """Borrow a pooled connection: `async with connect() as db: ...`"""
+    return pool.connection()
 
 
-async def get_next_user_id():
-    async with aiosqlite.connect("database.db") as db:
-        async with db.execute("SELECT COUNT(*) FROM users") as cursor:
-            row = await cursor.fetchone()
-            return row[0] or 0
+def _execute(conn, sql, parameters=()):
+    """A write of a single statement, for writer.write; returns its rowcount."""
+    return conn.execute(sql, parameters).rowcount
+
+
+def _executemany(conn, sql, seq_of_parameters):
+    """A write of one statement run for many rows; returns its rowcount."""
+    return conn.executemany(sql, seq_of_parameters).rowcount
+
+
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    """Verify a plain password against a hashed password."""
+    return await hasher.run(pwd_context.verify, plain_password, hashed_password)
 
 
 def generate_jwt_token(name: str) -> str:
@@ -50,46 +87,11 @@ def generate_jwt_token(name: str) -> str:
 
 
 async def create_schema():
-    async with aiosqlite.connect("database.db") as db:
-        await db.execute(
-            """
-            CREATE TABLE IF NOT EXISTS users (
-                token TEXT,
-                id INT PRIMARY KEY UNIQUE,
-                name TEXT UNIQUE NOT NULL,
-                pass TEXT NOT NULL,
-                authlvl INTEGER DEFAULT 0,
-                display TEXT,
-                deleted INT DEFAULT 0
-            );
-        """
-        )
-        await db.execute(
-            """
-            CREATE TABLE IF NOT EXISTS weeks (
-                week INT,
-                year INT,
-                mon TEXT,
-                tue TEXT,
-                wed TEXT,
-                thu TEXT,
-                fri TEXT
-            );
-        """
-        )
-        await db.execute(
-            """
-                CREATE TABLE IF NOT EXISTS comments (
-                week INT,
-                year INT,
-                day INT,
-                id INT PRIMARY KEY,
-                value TEXT,
-                author INT
-                );
-        """
-        )
-        await db.commit()
+    async with pool.writable() as db:
+        # persistent, so this only does anything the first time; readers
+        # then no longer block the writer or each other
+        await db.execute("PRAGMA journal_mode = WAL")
+        await migrations.migrate(db)
 
         async with db.execute(
             "SELECT 1 FROM users WHERE name = ?", ("adminacc",)
@@ -97,63 +99,76 @@ async def create_schema():
             exists = await cursor.fetchone()
 
         if not exists:
-            await register("adminacc", "adminpassword", int(AuthLevels.Admin.value))
+            try:
+                await register(
+                    "adminacc", "adminpassword", int(AuthLevels.Admin.value)
+                )
+            except Exception:
+                # another worker starting up at the same time may have got
+                # there first, either before or after register's own check
+                async with db.execute(
+                    "SELECT 1 FROM users WHERE name = ?", ("adminacc",)
+                ) as cursor:
+                    if await cursor.fetchone() is None:
+                        raise
 
 
 async def signin(username: str, passwd: str):
-    async with aiosqlite.connect("database.db") as db:
+    async with connect() as db:
         async with db.execute(
             "SELECT name, pass FROM users WHERE name = ?", (username,)
         ) as cursor:
             user = await cursor.fetchone()
 
-        if user is None or not verify_password(passwd, user[1]):
-            raise Exception("Invalid credentials")
+    if user is None or not await verify_password(passwd, user[1]):
+        raise Exception("Invalid credentials")
 
-        tok = generate_jwt_token(user[1])
+    tok = generate_jwt_token(user[1])
 
-        await db.execute("UPDATE users SET token = ? WHERE name = ?;", (tok, user[0]))
-        await db.commit()
+    await writer.write(
+        _execute, "UPDATE users SET token = ? WHERE name = ?;", (tok, user[0])
+    )
 
-        return tok
+    # the previous token stopped working
+    users_by_token.invalidate_where(
+        lambda e: e[1] is not None and e[1]["name"] == user[0]
+    )
+    users_by_token.invalidate(tok)
+    return tok
 
 
 async def register(username: str, passwd: str, authlvl):
-    async with aiosqlite.connect("database.db") as db:
-        async with db.execute(
-            "SELECT 1 FROM users WHERE name = ?", (username,)
-        ) as cursor:
-            exists = await cursor.fetchone()
-
-        if exists:
-            raise Exception("User already exists")
-        
-        ca = await get_next_user_id()
-        await db.execute(
-            "INSERT INTO users (token, name, pass, authlvl, display, id) VALUES (?, ?, ?, ?, ?, ?)",
-            (
-                "",
-                username.lower(),
-                hash_password(passwd),
-                authlvl,
-                username,
-                ca,
-            ),
-        )
-        await db.commit()
+    hashed = await hash_password(passwd)
+    await writer.write(_insert_user, username, hashed, authlvl)
+
+
+def _insert_user(conn, username, hashed, authlvl):
+    # checked and numbered inside the write transaction, so users registering
+    # at the same time can't get the same id
+    if conn.execute("SELECT 1 FROM users WHERE name = ?", (username,)).fetchone():
+        raise Exception("User already exists")
+
+    (ca,) = conn.execute("SELECT COALESCE(MAX(id), -1) + 1 FROM users").fetchone()
+    conn.execute(
+        "INSERT INTO users (token, name, pass, authlvl, display, id) VALUES (?, ?, ?, ?, ?, ?)",
+        (
+            "",
+            username.lower(),
+            hashed,
+            authlvl,
+            username,
+            ca,
+        ),
+    )
 
 
 async def id_by_token(token: str) -> int | None:
-    async with aiosqlite.connect("database.db") as db:
-        async with db.execute(
-            "SELECT id FROM users WHERE token = ?", (token,)
-        ) as cursor:
-            row = await cursor.fetchone()
-            return int(row[0]) if row is not None else None
+    user = await user_by_token(token)
+    return int(user["id"]) if user is not None else None
 
 
 async def get_all_users():
-    async with aiosqlite.connect("database.db") as db:
+    async with connect() as db:
         async with db.execute(
             "SELECT id,name,display,authlvl,deleted FROM users"
         ) as cursor:
@@ -174,14 +189,41 @@ async def get_all_users():
             return r
 
 
+def forget_user(id):
+    """Drop cached lookups for a user whose record just changed."""
+    users_by_token.invalidate_where(
+        lambda e: e[1] is not None and str(e[1]["id"]) == str(id)
+    )
+
+
 async def user_by_token(t: str):
-    async with aiosqlite.connect("database.db") as db:
+    cached = users_by_token.get(t)
+    if cached is not MISSING and (
+        cached[1] is None or cached[0] == user_versions.current(user_key(cached[1]))
+    ):
+        return cached[1]
+    version, user = await _user_by_token(t)
+    users_by_token.set(t, (version, user))
+    return user
+
+
+def user_key(user) -> str:
+    return f"user:{user['id']}"
+
+
+async def _user_by_token(t: str):
+    """(version of the user's row, user dict), or (0, None) for an unknown
+    token; read together, so a change committed in between can't be missed."""
+    async with connect() as db:
         async with db.execute(
-            "SELECT id,name,display,authlvl,deleted FROM users WHERE token = ?", (t,)
+            "SELECT id,name,display,authlvl,deleted,COALESCE(version, 0) "
+            "FROM users LEFT JOIN versions ON key = 'user:' || id "
+            "WHERE token = ?",
+            (t,),
         ) as cursor:
             row = await cursor.fetchone()
             if row is None:
-                return None
+                return 0, None
             r = {
                 "id": row[0],
                 "name": row[1],
@@ -191,11 +233,11 @@ async def user_by_token(t: str):
                 "deleted": bool(row[4]),
             }
 
-            return r
+            return row[5], r
 
 
 async def user_by_id(i: int):
-    async with aiosqlite.connect("database.db") as db:
+    async with connect() as db:
         async with db.execute(
             "SELECT id,name,display,authlvl,deleted FROM users WHERE id = ?", (i,)
         ) as cursor:
@@ -215,9 +257,10 @@ async def user_by_id(i: int):
 
 
 async def tokenrevoke(token):
-    async with aiosqlite.connect("database.db") as db:
-        await db.execute("UPDATE users SET token = ? WHERE token = ?", (None, token))
-        await db.commit()
+    await writer.write(
+        _execute, "UPDATE users SET token = ? WHERE token = ?", (None, token)
+    )
+    users_by_token.invalidate(token)
 
 
 async def set_food(year, week, day, value):
@@ -226,219 +269,539 @@ async def set_food(year, week, day, value):
 
     col = weekdays[day - 1]
 
-    async with aiosqlite.connect("database.db") as db:
-        cursor = await db.execute(
-            f"UPDATE weeks SET {col} = ? WHERE week = ? AND year = ?",
-            (value, week, year),
-        )
-        await db.commit()
-
-        if cursor.rowcount == 0:
-            values = [""] * len(weekdays)
-            values[day - 1] = value
-            await db.execute(
-                f"INSERT INTO weeks (year, week, {','.join(weekdays)}) VALUES (?, ?, {','.join(['?'] * len(weekdays))})",
-                (year, week, *values),
+    values = [""] * len(weekdays)
+    values[day - 1] = value
+
+    await writer.write(
+        _execute,
+        f"INSERT INTO weeks (year, week, {','.join(weekdays)}) VALUES (?, ?, {','.join(['?'] * len(weekdays))}) "
+        f"ON CONFLICT (year, week) DO UPDATE SET {col} = excluded.{col}",
+        (year, week, *values),
+    )
+
+
+def food_row(row):
+    """Validate one (year, week, weekday, dish) row for set_food_bulk."""
+    try:
+        year, week, day, value = row
+        year, week, day = int(year), int(week), int(day)
+    except (TypeError, ValueError):
+        raise ValueError(f"Malformed food row: {row!r}")
+    if not (1 <= week <= 53 and 1 <= day <= len(weekdays)) or not isinstance(
+        value, str
+    ):
+        raise ValueError(f"Malformed food row: {row!r}")
+    return year, week, day, value
+
+
+async def set_food_bulk(rows, batch_size=500, dry_run=False):
+    """Apply many (year, week, weekday, dish) rows as one write.
+
+    `rows` may be any iterable, including a generator still parsing an
+    upload. It is read and validated a batch at a time on a thread of its
+    own, and each batch is staged in a temporary table on the writer's
+    connection, so neither the upload nor its rows are ever held in memory
+    whole and parsing never holds up other writes. Only once every row is
+    valid are they applied, in one write: any malformed row raises
+    ValueError without changing the weeks table. Days whose dish didn't
+    change are not written at all. Returns how many days were inserted,
+    updated and left unchanged, and under "changes" every (year, week,
+    weekday, old, new) that was written. `dry_run` works all of that out
+    without writing anything.
+    """
+    rows = iter(rows)
+    table = f"temp.food_import_{next(_food_imports)}"
+    await writer.write(
+        _execute, f"CREATE TABLE {table} (year INT, week INT, day INT, value TEXT)"
+    )
+    try:
+        while batch := await asyncio.to_thread(_food_rows, rows, batch_size):
+            await writer.write(
+                _executemany, f"INSERT INTO {table} VALUES (?, ?, ?, ?)", batch
             )
-            await db.commit()
+        return await writer.write(_set_food_bulk, table, batch_size, dry_run)
+    finally:
+        await writer.write(_execute, f"DROP TABLE {table}")
+
+
+# numbers the staging tables of set_food_bulk, which may run concurrently
+_food_imports = itertools.count()
+
+
+def _food_rows(rows, batch_size) -> list:
+    return [food_row(row) for row in itertools.islice(rows, batch_size)]
+
+
+def _set_food_bulk(conn, table, batch_size, dry_run=False):
+    summary = {"inserted": 0, "updated": 0, "unchanged": 0, "changes": []}
+    current = {}  # (year, week) -> [mon..fri] as the transaction will leave it
+    columns = ",".join(weekdays)
+    upsert = (
+        f"INSERT INTO weeks (year, week, {columns}) VALUES (?, ?, {','.join(['?'] * len(weekdays))}) "
+        f"ON CONFLICT (year, week) DO UPDATE SET "
+        + ", ".join(f"{col} = excluded.{col}" for col in weekdays)
+    )
+
+    staged = conn.execute(f"SELECT year, week, day, value FROM {table} ORDER BY rowid")
+    while batch := staged.fetchmany(batch_size):
+        missing = list({(y, w) for y, w, _, _ in batch} - current.keys())
+        if missing:
+            for row in conn.execute(
+                f"SELECT year, week, {columns} FROM weeks WHERE (year, week) IN "
+                f"(VALUES {','.join(['(?, ?)'] * len(missing))})",
+                [v for key in missing for v in key],
+            ).fetchall():
+                current[(row[0], row[1])] = [d or "" for d in row[2:]]
+
+        changed = {}
+        for year, week, day, value in batch:
+            days = current.setdefault((year, week), [""] * len(weekdays))
+            if days[day - 1] == value:
+                summary["unchanged"] += 1
+                continue
+            summary["updated" if days[day - 1] else "inserted"] += 1
+            summary["changes"].append((year, week, day, days[day - 1], value))
+            days[day - 1] = value
+            changed[(year, week)] = days
+
+        if changed and not dry_run:
+            conn.executemany(upsert, [(*key, *days) for key, days in changed.items()])
+
+    return summary
 
 
 async def get_food(year, week, day):
-    async with aiosqlite.connect("database.db") as db:
-        day = weekdays[day]
+    return menus.year(year).dishes[week][day] if 0 <= week < 54 else ""
+
+
+async def get_week(year, week):
+    """Dishes and comment counts for mon-fri of one week.
+
+    Dishes come from the menu store and counts from comment_counts
+    (migration 7), so soft-deleted comments aren't counted.
+    """
+    async with connect() as db:
         async with db.execute(
-            f"SELECT {day} FROM weeks WHERE week = ? and year = ?", (week, year)
+            "SELECT day, n FROM comment_counts WHERE year = ? AND week = ?",
+            (year, week),
         ) as cursor:
-            val = await cursor.fetchone()
-            return val[0] if val else ""
+            counts = dict(await cursor.fetchall())
+
+    dishes = menus.year(year).dishes[week] if 0 <= week < 54 else [""] * 5
+    return [
+        {"day": i, "text": dishes[i], "comments": counts.get(i, 0)}
+        for i in range(len(weekdays))
+    ]
 
 
 async def get_food_year(year):
-    async with aiosqlite.connect("database.db") as db:
+    """Every ISO week of `year` with its monday and dishes; shared by every
+    caller, so don't modify it."""
+    return menus.year(year).table
+
+
+async def menu_years() -> set[int]:
+    """Every year with at least one week of menu."""
+    async with connect() as db:
+        async with db.execute("SELECT DISTINCT year FROM weeks") as cursor:
+            return {row[0] for row in await cursor.fetchall()}
+
+
+async def get_comment_counts_year(year):
+    """Comment count per day for every ISO week of `year`, as [week - 1][day]."""
+    async with connect() as db:
         async with db.execute(
-            "SELECT week, mon, tue, wed, thu, fri FROM weeks WHERE year = ?", (year,)
+            "SELECT week, day, n FROM comment_counts WHERE year = ?", (year,)
         ) as cursor:
-            existing = {row[0]: row[1:] for row in await cursor.fetchall()}
+            rows = await cursor.fetchall()
 
     total_weeks = datetime.date(year, 12, 28).isocalendar()[1]
-    result = []
-    for week in range(1, total_weeks + 1):
-        date = datetime.datetime.fromisocalendar(year, week, 1)
-        days = list(existing.get(week, [""] * 5))
-        result.append(
-            {
-                "date": date,
-                "week": week,
-                "days": [{"text": days[i], "day": i + 1} for i in range(5)],
-            }
-        )
-    return result
+    grid = [[0] * len(weekdays) for _ in range(total_weeks)]
+    for week, day, count in rows:
+        if 1 <= week <= total_weeks and 0 <= day < len(weekdays):
+            grid[week - 1][day] = count
+    return grid
 
 
 async def delete_account(id):
     if id == 0:
         raise Exception("The Admin Account is protected!")
-    async with aiosqlite.connect("database.db") as db:
-        await db.execute(
-            "UPDATE users SET (token,name,pass,display,authlvl,deleted) = (?,?,?,?,?,?) WHERE id = ?",
-            ("", f"deleted_user{id}", "deletedaccount", "Deleted User", -1, 1, id),
-        )
-        await db.commit()
+    await writer.write(
+        _execute,
+        "UPDATE users SET (token,name,pass,display,authlvl,deleted) = (?,?,?,?,?,?) WHERE id = ?",
+        ("", f"deleted_user{id}", "deletedaccount", "Deleted User", -1, 1, id),
+    )
+    forget_user(id)
 
 
 async def edit_permission(id, perm):
     if id == 0:
         raise Exception("The Admin Account is protected!")
-    async with aiosqlite.connect("database.db") as db:
-        await db.execute("UPDATE users SET authlvl = ? WHERE id = ?", (perm, id))
-        await db.commit()
+    await writer.write(
+        _execute, "UPDATE users SET authlvl = ? WHERE id = ?", (perm, id)
+    )
+    forget_user(id)
 
 
 async def change_password(id, old, new):
     # the admin account is not protected against password changing.
-    async with aiosqlite.connect("database.db") as db:
+    async with connect() as db:
         async with db.execute("SELECT pass FROM users WHERE id = ?", (id,)) as cursor:
             current = await cursor.fetchone()
 
-        if not current or not verify_password(old, current[0]):
-            raise Exception("Incorrect current password.")
-        await db.execute(
-            "UPDATE users SET pass = ? WHERE id = ?", (hash_password(new), id)
-        )
-        await db.commit()
+    if not current or not await verify_password(old, current[0]):
+        raise Exception("Incorrect current password.")
+    hashed = await hash_password(new)
+    await writer.write(_execute, "UPDATE users SET pass = ? WHERE id = ?", (hashed, id))
+
+
+def week_key(year, week) -> str:
+    return f"week:{int(year)}:{int(week)}"
+
+
+def year_key(year) -> str:
+    return f"year:{int(year)}"
+
+
+async def get_versions(*keys) -> dict:
+    """Current (version, modified) of each key; (0, 0.0) if never written.
+
+    Versions are bumped by triggers (see migrations 4 and 5) on every write
+    to weeks, comments and users, so they are shared by all workers. Keys
+    are week_key(), year_key(), "users" and "comments".
+    """
+    async with connect() as db:
+        async with db.execute(
+            f"SELECT key, version, modified FROM versions WHERE key IN ({','.join(['?'] * len(keys))})",
+            keys,
+        ) as cursor:
+            found = {row[0]: (row[1], row[2]) for row in await cursor.fetchall()}
+    return {key: found.get(key, (0, 0.0)) for key in keys}
+
+
+# comments joined with their author, shared by every comment listing
+COMMENT_SELECT = """
+    SELECT c.value, c.id, c.author, u.name, u.display, c.year, c.week, c.day
+    FROM comments c LEFT JOIN users u ON u.id = c.author
+"""
+
+
+def comment_from_row(row) -> dict:
+    return {
+        "name": row[4],
+        "comment": row[0],
+        "id": row[1],
+        "author": f"{row[3]}#{row[2]}",
+    }
 
 
 async def getcomments(year, week, weekday):
-    async with aiosqlite.connect("database.db") as db:
+    async with connect() as db:
         async with db.execute(
-            "SELECT value, id, author FROM comments WHERE year = ? AND week = ? AND day = ?",
+            COMMENT_SELECT + "WHERE c.year = ? AND c.week = ? AND c.day = ?",
             (year, week, weekday),
         ) as cursor:
-            selection = await cursor.fetchall()
+            return [comment_from_row(row) for row in await cursor.fetchall()]
+
+
+async def addcomment(year, week, weekday, value, authorid):
+    await writer.write(_insert_comment, year, week, weekday, value, authorid)
+
+
+def _insert_comment(conn, year, week, weekday, value, authorid):
+    # numbered inside the write transaction, so comments posted at the same
+    # time (and batched together) get distinct ids; MAX rather than COUNT,
+    # which a hard-deleted comment would make hand out a taken id
+    (ca,) = conn.execute("SELECT COALESCE(MAX(id), -1) + 1 FROM comments").fetchone()
+    conn.execute(
+        "INSERT INTO comments ( year, week, day, author, value, id ) VALUES ( ?, ?, ?, ?, ?, ? )",
+        (year, week, weekday, authorid, value, ca),
+    )
+
+
+# what comment_counts should hold, from the comments themselves
+COUNTED_COMMENTS = """
+    SELECT year, week, day, COUNT(*) AS n FROM comments
+    WHERE value IS NOT '<Deleted>'
+      AND year IS NOT NULL AND week IS NOT NULL AND day IS NOT NULL
+    GROUP BY year, week, day
+"""
 
-        r = []
-        for row in selection:
-            r.append(
-                {
-                    "name": (await user_by_id(row[2]))["display"],
-                    "comment": row[0],
-                    "id": row[1],
-                    "author": await get_author_by_comment_id(row[1]),
-                }
+
+async def comment_count_mismatches():
+    """(year, week, day, counted, stored) for every day where comment_counts
+    disagrees with the comments table; empty when the triggers kept up."""
+    async with connect() as db:
+        async with db.execute(
+            f"""
+            SELECT year, week, day, SUM(counted), SUM(stored) FROM (
+                SELECT year, week, day, n AS counted, 0 AS stored
+                FROM ({COUNTED_COMMENTS})
+                UNION ALL
+                SELECT year, week, day, 0, n FROM comment_counts
             )
-        return r
+            GROUP BY year, week, day HAVING SUM(counted) != SUM(stored)
+            ORDER BY year, week, day
+            """
+        ) as cursor:
+            return await cursor.fetchall()
 
 
-async def addcomment(year, week, weekday, value, authorid):
-    async with aiosqlite.connect("database.db") as db:
-        ca = await numcomments()
-        await db.execute(
-            "INSERT INTO comments ( year, week, day, author, value, id ) VALUES ( ?, ?, ?, ?, ?, ? )",
-            (year, week, weekday, authorid, value, ca),
-        )
-        await db.commit()
+async def rebuild_comment_counts():
+    await writer.write(_rebuild_comment_counts)
 
 
-async def numcomments():
-    async with aiosqlite.connect("database.db") as db:
-        async with db.execute("SELECT COUNT(*) FROM comments") as cursor:
-            return (await cursor.fetchone())[0]
+def _rebuild_comment_counts(conn):
+    conn.execute("DELETE FROM comment_counts")
+    conn.execute(
+        f"INSERT INTO comment_counts (year, week, day, n) {COUNTED_COMMENTS}"
+    )
 
 
 async def changedisplay(id, new):
-    async with aiosqlite.connect("database.db") as db:
-        await db.execute("UPDATE users SET display = ? WHERE id = ?", (new, id))
-        await db.commit()
+    await writer.write(_execute, "UPDATE users SET display = ? WHERE id = ?", (new, id))
+    forget_user(id)
 
 
 async def editlogin(id, new):
-    async with aiosqlite.connect("database.db") as db:
-        async with db.execute(
-            "SELECT 1 FROM users WHERE name = ? AND id != ?", (new, id)
-        ) as cursor:
-            exists = await cursor.fetchone()
+    await writer.write(_rename_user, id, new)
+    forget_user(id)
+
 
-        if exists:
-            raise Exception("Username already taken")
+def _rename_user(conn, id, new):
+    if conn.execute(
+        "SELECT 1 FROM users WHERE name = ? AND id != ?", (new, id)
+    ).fetchone():
+        raise Exception("Username already taken")
 
-        await db.execute("UPDATE users SET name = ? WHERE id = ?", (new, id))
-        await db.commit()
+    conn.execute("UPDATE users SET name = ? WHERE id = ?", (new, id))
 
 
 async def get_author_by_comment_id(id: int):
-    async with aiosqlite.connect("database.db") as db:
+    async with connect() as db:
         async with db.execute(
-            "SELECT author FROM comments WHERE id = ?", (id,)
+            "SELECT u.name, c.author FROM comments c LEFT JOIN users u ON u.id = c.author "
+            "WHERE c.id = ?",
+            (id,),
         ) as cursor:
-            id = (await cursor.fetchone())[0]
-            info = await user_by_id(id)
-            return f"{info['name']}#{id}"
+            row = await cursor.fetchone()
+            return f"{row[0]}#{row[1]}"
 
 
 async def delcomment(id, fr=False):
-    async with aiosqlite.connect("database.db") as db:
-        if not fr:
-            await db.execute(
-                "UPDATE comments SET value = ? WHERE id = ?",
-                (
-                    "<Deleted>",
-                    id,
-                ),
-            )
-        else:
-            await db.execute("DELETE FROM comments WHERE id = ?", (id,))
-        await db.commit()
+    if not fr:
+        await writer.write(
+            _execute,
+            "UPDATE comments SET value = ? WHERE id = ?",
+            (
+                "<Deleted>",
+                id,
+            ),
+        )
+    else:
+        await writer.write(_execute, "DELETE FROM comments WHERE id = ?", (id,))
 
 
 async def getallcomments():
-    async with aiosqlite.connect("database.db") as db:
+    async with connect() as db:
+        async with db.execute(COMMENT_SELECT) as cursor:
+            selection = await cursor.fetchall()
+
+    r = {}
+    for row in selection:
+        date = datetime.datetime.fromisocalendar(row[5], row[6], row[7] + 1)
+        r[date.strftime("%a %b %d %Y ") + str(row[1])] = {
+            **comment_from_row(row),
+            "date": [date, row[5], row[6], row[7]],
+        }
+    return r
+
+
+# the date of (year, week, day) computed by SQLite: monday of ISO week 1 is
+# the monday on or before january 4th
+COMMENT_DATE = """
+    date(
+        printf('%04d-01-04', c.year),
+        '-' || ((strftime('%w', printf('%04d-01-04', c.year)) + 6) % 7) || ' days',
+        '+' || ((c.week - 1) * 7 + c.day) || ' days'
+    )
+"""
+
+
+async def comments_page(after: int = -1, limit: int = 100):
+    """Up to `limit` comments with an id greater than `after`, oldest first.
+
+    Keyset pagination: pass the last id of one page as `after` to get the
+    next, so every page is one index range scan however deep it is.
+    """
+    async with connect() as db:
         async with db.execute(
-            "SELECT value, id, author,year,week,day FROM comments",
+            f"""
+            SELECT c.id, u.display, c.value, u.name, c.author,
+                   {COMMENT_DATE}, c.year, c.week, c.day
+            FROM comments c LEFT JOIN users u ON u.id = c.author
+            WHERE c.id > ? ORDER BY c.id LIMIT ?
+            """,
+            (after, limit),
         ) as cursor:
-            selection = await cursor.fetchall()
+            rows = await cursor.fetchall()
 
-        r = {}
-        for row in selection:
-            r[
-                str(
-                    datetime.datetime.fromisocalendar(
-                        row[3], row[4], row[5] + 1
-                    ).strftime("%a %b %d %Y ")
-                )
-                + str(row[1])
-            ] = {
-                "name": (await user_by_id(row[2]))["display"],
-                "comment": row[0],
-                "id": row[1],
-                "author": f"{(await user_by_id(row[2]))['name']}#{row[2]}",
-                "date": [
-                    datetime.datetime.fromisocalendar(row[3], row[4], row[5] + 1),
-                    row[3],
-                    row[4],
-                    row[5],
-                ],
-            }
-        return r
+    return [
+        {
+            "id": row[0],
+            "name": row[1],
+            "comment": row[2],
+            "author": f"{row[3]}#{row[4]}",
+            "date": row[5],
+            "year": row[6],
+            "week": row[7],
+            "day": row[8],
+        }
+        for row in rows
+    ]
 
 
 async def comment_by_id(id: int):
-    async with aiosqlite.connect("database.db") as db:
+    async with connect() as db:
+        async with db.execute(COMMENT_SELECT + "WHERE c.id = ?", (id,)) as cursor:
+            row = await cursor.fetchone()
+            return comment_from_row(row) if row is not None else None
+
+
+# highlight() markers around matched words, split out again by _highlighted
+MARK_START, MARK_END = "\x02", "\x03"
+search_word_re = re.compile(r"\w+")
+
+
+def match_query(text: str) -> str | None:
+    """FTS5 query for rows containing every word of `text`, each as a prefix.
+
+    Words are quoted, so nothing a user types is taken as FTS5 syntax.
+    """
+    return " ".join(f'"{word}"*' for word in search_word_re.findall(text)) or None
+
+
+def _highlighted(text: str) -> list:
+    """[[text, matched], ...] from a highlight() result."""
+    parts = []
+    for i, part in enumerate(re.split(f"[{MARK_START}{MARK_END}]", text)):
+        if part:
+            parts.append([part, i % 2 == 1])
+    return parts
+
+
+def _iso_date(year, week, day):
+    try:
+        return datetime.date.fromisocalendar(year, week, day + 1).isoformat()
+    except ValueError:
+        return None
+
+
+async def search(
+    query: str,
+    source: str = "dishes",
+    limit: int = 20,
+    offset: int = 0,
+    newest: bool = False,
+):
+    """Days whose dish (`source="dishes"`) or comments (`"comments"`) contain
+    every word of `query`, best match first or with `newest` latest first.
+
+    Words match case-insensitively, ignoring diacritics, and as prefixes of
+    longer words ("fisk" finds "Fiskgratäng"); see migration 6. Every hit
+    has its year, week, day (0 for monday) and date, and under "highlighted"
+    its text split into [text, matched] parts.
+    """
+    match = match_query(query)
+    if match is None:
+        return []
+
+    if source == "dishes":
+        sql = f"""
+            SELECT rowid, dish, highlight(dishes_fts, 0, ?, ?)
+            FROM dishes_fts WHERE dishes_fts MATCH ?
+            ORDER BY {"rowid DESC" if newest else "rank"} LIMIT ? OFFSET ?
+        """
+    elif source == "comments":
+        sql = f"""
+            SELECT c.id, c.value, highlight(comments_fts, 0, ?, ?),
+                   c.year, c.week, c.day, u.display, u.name, c.author
+            FROM comments_fts f JOIN comments c ON c.id = f.rowid
+            LEFT JOIN users u ON u.id = c.author
+            WHERE comments_fts MATCH ?
+            ORDER BY {"c.year DESC, c.week DESC, c.day DESC, c.id DESC" if newest else "f.rank"}
+            LIMIT ? OFFSET ?
+        """
+    else:
+        raise ValueError(f"Unknown search source: {source!r}")
+
+    async with connect() as db:
         async with db.execute(
-            "SELECT value, id, author FROM comments WHERE id = ?",
-            (id,),
+            sql, (MARK_START, MARK_END, match, limit, offset)
         ) as cursor:
-            row = await cursor.fetchone()
+            rows = await cursor.fetchall()
 
-            return {
-                "name": (await user_by_id(row[2]))["display"],
-                "comment": row[0],
-                "id": row[1],
-                "author": await get_author_by_comment_id(row[1]),
+    hits = []
+    for row in rows:
+        if source == "dishes":
+            year, week, day = row[0] // 1000, row[0] // 10 % 100, row[0] % 10
+            hit = {"dish": row[1]}
+        else:
+            year, week, day = row[3:6]
+            hit = {
+                "id": row[0],
+                "name": row[6],
+                "comment": row[1],
+                "author": f"{row[7]}#{row[8]}",
             }
-
-
-def init_app():
-    asyncio.run(create_schema())
+        hits.append(
+            {
+                "year": year,
+                "week": week,
+                "day": day,
+                "date": _iso_date(year, week, day),
+                **hit,
+                "highlighted": _highlighted(row[2]),
+            }
+        )
+    return hits
+
+
+# every coroutine above records its calls, latency, statements and rows
+metrics.instrument(sys.modules[__name__])
+
+
+def init_app(app=None):
+    global pool, writer, menus, user_versions, hasher
+    database = app.config["DATABASE"] if app is not None else "database.db"
+    size = app.config.get("DATABASE_POOL_SIZE", 8) if app is not None else 8
+    pool = Pool(database, size, readonly=True)
+    writer = Writer(database)
+    menus = MenuStore(database)
+    user_versions = VersionWatch(database)
+    if app is not None:
+        users_by_token.maxsize = app.config.get("TOKEN_CACHE_SIZE", 1024)
+        users_by_token.ttl = app.config.get("TOKEN_CACHE_TTL", 30.0)
+        hasher = Hasher(
+            app.config.get("HASH_WORKERS", 2), app.config.get("HASH_QUEUE", 16)
+        )
+        writer.window = app.config.get("WRITE_BATCH_WINDOW_MS", 0) / 1000
+        writer.max_batch = app.config.get("WRITE_BATCH_SIZE", 256)
+        writer.wal_limit = app.config.get("WAL_LIMIT_MB", 64) << 20
+        metrics.registry.configure(app.config.get("METRICS_DIR"))
+        slowlog.configure(
+            app.config.get("SLOW_QUERY_MS", 100), app.config.get("SLOW_QUERY_LOG")
+        )
+    atexit.register(shutdown, pool, writer)
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        asyncio.run(create_schema())
+    else:
+        # called from an ASGI server's app factory, inside its event loop
+        with ThreadPoolExecutor(1) as executor:
+            executor.submit(asyncio.run, create_schema()).result()
+    menus.preload()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,98 @@
+import codecs
+import json
+
+weekdays_en = ["mon", "tue", "wed", "thu", "fri"]
+
+# whitespace allowed between JSON tokens
+WHITESPACE = " \t\r\n"
+
+
+def _tokens(stream, chunk_size):
+    """Yield JSON tokens from a binary stream, reading it a chunk at a time.
+
+    Structural characters come out as themselves, every scalar as
+    ("value", obj). Only the current chunk is ever held in memory.
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    buf, pos, eof = "", 0, False
+
+    def fill():
+        nonlocal buf, pos, eof
+        chunk = stream.read(chunk_size)
+        eof = not chunk
+        buf = buf[pos:] + utf8.decode(chunk, final=eof)
+        pos = 0
+
+    while True:
+        while pos < len(buf) and buf[pos] in WHITESPACE:
+            pos += 1
+        if pos == len(buf):
+            if eof:
+                return
+            fill()
+            continue
+
+        if buf[pos] in "{}[]:,":
+            yield buf[pos]
+            pos += 1
+            continue
+
+        try:
+            value, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            fill()  # the token is cut off at the end of the buffer
+            continue
+        if end == len(buf) and not eof:
+            fill()  # a number like 12 might really be 123
+            continue
+        yield ("value", value)
+        pos = end
+
+
+def iter_food_json(stream, chunk_size=64 * 1024):
+    """Yield (year, week, weekday, dish) from an uploaded food JSON file.
+
+    The file is the {year: {week: {day: dish}}} object written by pdf2json.
+    It is parsed incrementally, so a large upload is never loaded whole.
+    Day names are matched on their first three letters and unknown days are
+    skipped; weekday is 1 for monday.
+    """
+    tokens = _tokens(stream, chunk_size)
+
+    def expect(want):
+        tok = next(tokens, None)
+        if tok != want:
+            raise ValueError(f"Malformed food JSON: expected {want!r}, got {tok!r}")
+
+    def members(path):
+        expect("{")
+        tok = next(tokens, None)
+        if tok == "}":
+            return
+        while True:
+            if not (isinstance(tok, tuple) and isinstance(tok[1], str)):
+                raise ValueError(f"Malformed food JSON: expected a key, got {tok!r}")
+            key = tok[1]
+            expect(":")
+            if len(path) < 2:
+                yield from members(path + [key])
+            else:
+                tok = next(tokens, None)
+                if not isinstance(tok, tuple):
+                    raise ValueError(f"Malformed food JSON: bad value for {key!r}")
+                day_short = key[:3].lower()
+                if day_short in weekdays_en:
+                    yield (*path, weekdays_en.index(day_short) + 1, tok[1])
+            tok = next(tokens, None)
+            if tok == "}":
+                return
+            if tok != ",":
+                raise ValueError(f"Malformed food JSON: expected ',' got {tok!r}")
+            tok = next(tokens, None)
+
+    yield from members([])
+    if next(tokens, None) is not None:
+        raise ValueError("Malformed food JSON: trailing data")
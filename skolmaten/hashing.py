@@ -0,0 +1,63 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Overloaded(Exception):
+    """Too many password hashes are already running or queued."""
+
+
+class Hasher:
+    """Runs bcrypt work on a small dedicated thread pool.
+
+    At most `workers` hashes run at once and at most `queue` more wait
+    behind them; anything beyond that is rejected straight away with
+    Overloaded instead of piling up behind a burst of logins. bcrypt
+    releases the GIL, so the threads don't hold up the event loop.
+    `workers=0` hashes inline on the caller's thread.
+    """
+
+    def __init__(self, workers: int = 2, queue: int = 16):
+        self.workers = workers
+        self.queue = queue
+        self._executor = (
+            ThreadPoolExecutor(workers, thread_name_prefix="bcrypt")
+            if workers > 0
+            else None
+        )
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.rejected = 0
+
+    async def run(self, fn, *args):
+        if self._executor is None:
+            return fn(*args)
+
+        with self._lock:
+            if self.pending >= self.workers + self.queue:
+                self.rejected += 1
+                raise Overloaded("Too many logins right now, try again shortly.")
+            self.pending += 1
+        try:
+            future = self._executor.submit(fn, *args)
+        except BaseException:
+            self._done(None)
+            raise
+        future.add_done_callback(self._done)
+        return await asyncio.wrap_future(future)
+
+    def _done(self, future):
+        with self._lock:
+            self.pending -= 1
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "queue": self.queue,
+            "pending": self.pending,
+            "rejected": self.rejected,
+        }
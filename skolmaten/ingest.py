@@ -0,0 +1,74 @@
+"""Load caterer menu PDFs straight into the database.
+
+Parses every PDF given, works out the year of each day from its printed
+date, and writes the days that differ from what the `weeks` table already
+has in one transaction. Later files win where they cover the same day.
+
+    python -m skolmaten.ingest menu-ht.pdf menu-vt.pdf
+    python -m skolmaten.ingest --dry-run --database /app/data/database.db menu.pdf
+    python -m skolmaten.ingest --no-cache menu.pdf
+"""
+
+import argparse
+import asyncio
+import datetime
+import os
+
+from . import create_app, db, pdf2json
+
+
+def read_menus(paths, around, cache=True):
+    """(year, week, weekday, dish) for every day in the PDFs, last file winning."""
+    days = {}
+    for path in paths:
+        for year, week, day, dish in pdf2json.iter_menu(
+            pdf2json.extract_pages(path, cache=cache), year=None, around=around
+        ):
+            days[(int(year), week, db.weekdays.index(day) + 1)] = dish
+    return [(*key, dish) for key, dish in days.items()]
+
+
+def report(summary, dry_run):
+    for year, week, day, old, new in summary["changes"]:
+        date = datetime.date.fromisocalendar(year, week, day)
+        print(f"{date}  v.{week:<2} {db.weekdays[day - 1]}  {repr(old) if old else '-'} -> {new!r}")
+    verb = "would change" if dry_run else "changed"
+    print(
+        f"{verb} {summary['inserted'] + summary['updated']} days "
+        f"({summary['inserted']} new, {summary['updated']} updated), "
+        f"{summary['unchanged']} unchanged"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("pdfs", nargs="+", metavar="PDF")
+    parser.add_argument(
+        "--dry-run", action="store_true", help="show what would change, write nothing"
+    )
+    parser.add_argument("--database", help="defaults to $DATABASE or database.db")
+    parser.add_argument(
+        "--year",
+        type=int,
+        default=datetime.date.today().year,
+        help="the menus are dated within a year of this (default: this year)",
+    )
+    parser.add_argument(
+        "--no-cache",
+        dest="cache",
+        action="store_false",
+        help="extract every page again instead of using the PDF text cache",
+    )
+    args = parser.parse_args()
+
+    if args.database:
+        os.environ["DATABASE"] = args.database
+
+    create_app()
+    rows = read_menus(args.pdfs, args.year, args.cache)
+    summary = asyncio.run(db.set_food_bulk(rows, dry_run=args.dry_run))
+    report(summary, args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""The weeks table, kept in memory.
+
+A year of menus is a few kilobytes, so each worker holds every year that
+has a menu as a tuple of dishes per week, along with the year page's rows
+prebuilt as tuples. Years without a single row are built again when asked
+for rather than kept, so requests for arbitrary years can't grow the store
+past the years actually in the weeks table. Reading a menu never queries
+the database. It only asks SQLite's `PRAGMA data_version` on the store's
+own connection, which is answered from the WAL index in shared memory in a
+microsecond or two and changes whenever any connection, in this worker or
+another, commits. When it has changed, the "menu:<year>" version rows (see
+migration 8) tell which years to load again.
+"""
+
+import datetime
+import os
+import threading
+from collections import namedtuple
+
+from .pool import sqlite_connect
+
+WEEKDAYS = ["mon", "tue", "wed", "thu", "fri"]
+
+NO_DISHES = ("",) * len(WEEKDAYS)
+
+# a row of the year page, and one of its days
+Week = namedtuple("Week", ["date", "week", "days"])
+Day = namedtuple("Day", ["text", "day"])
+
+
+class Year:
+    __slots__ = ("year", "dishes", "table")
+
+    def __init__(self, year: int, rows):
+        self.year = year
+        # week -> (mon..fri); weeks without a row are all ""
+        dishes = [NO_DISHES] * 54
+        for week, *days in rows:
+            if 0 <= week < len(dishes):
+                dishes[week] = tuple(d or "" for d in days)
+        self.dishes = tuple(dishes)
+        total_weeks = datetime.date(year, 12, 28).isocalendar()[1]
+        self.table = tuple(
+            Week(
+                datetime.datetime.fromisocalendar(year, week, 1),
+                week,
+                tuple(Day(text, i + 1) for i, text in enumerate(dishes[week])),
+            )
+            for week in range(1, total_weeks + 1)
+        )
+
+
+class MenuStore:
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+        self._data_version = None
+        self._versions: dict[int, int] = {}  # year -> version of its rows
+        self._years: dict[int, Year] = {}
+        self.loads = 0
+        self.reloads = 0
+
+    def _check(self):
+        # with self._lock held
+        if self._pid != os.getpid():
+            # a connection must not cross a fork
+            self._pid = os.getpid()
+            self._conn = sqlite_connect(
+                self.path, readonly=True, check_same_thread=False
+            )
+            self._data_version = None
+        (data_version,) = self._conn.execute("PRAGMA data_version").fetchone()
+        if data_version == self._data_version:
+            return
+        self._data_version = data_version
+        versions = {
+            int(key.removeprefix("menu:")): version
+            for key, version in self._conn.execute(
+                "SELECT key, version FROM versions "
+                "WHERE key >= 'menu:' AND key < 'menu;'"
+            )
+        }
+        for year in list(self._years):
+            if versions.get(year, 0) != self._versions.get(year, 0):
+                # loaded again when next asked for
+                del self._years[year]
+                self.reloads += 1
+        self._versions = versions
+
+    def year(self, year: int) -> Year:
+        """The menu of `year` as it is now; don't modify it."""
+        year = int(year)
+        with self._lock:
+            self._check()
+            loaded = self._years.get(year)
+            if loaded is None:
+                rows = self._conn.execute(
+                    f"SELECT week, {','.join(WEEKDAYS)} FROM weeks WHERE year = ?",
+                    (year,),
+                ).fetchall()
+                loaded = Year(year, rows)
+                if rows:
+                    # an empty year is cheap to build again, and there is
+                    # no end to the years a client can ask for
+                    self._years[year] = loaded
+                    self.loads += 1
+            return loaded
+
+    def preload(self):
+        """Load every year that has a menu, so a worker starts warm."""
+        with self._lock:
+            self._check()
+            years = [
+                row[0] for row in self._conn.execute("SELECT DISTINCT year FROM weeks")
+            ]
+        for year in years:
+            self.year(year)
+
+    def stats(self) -> dict:
+        return {
+            "years": len(self._years),
+            "loads": self.loads,
+            "reloads": self.reloads,
+        }
@@ -0,0 +1,321 @@
+"""Request and database instrumentation, served at /metrics.
+
+Every db coroutine and every route records its calls and a latency
+histogram; db coroutines also record the SQL statements they ran and the
+rows those returned, and the pool counts the connections it opens. Figures
+are kept in memory by each worker. With METRICS_DIR set, a background thread
+writes them there about once a second, so whichever gunicorn worker answers
+a scrape reports the sum over all workers. A worker removes its file when it
+exits, and a scrape removes those of workers that died without doing so;
+their counts drop out of the sums, which Prometheus reads as a counter reset.
+"""
+
+import atexit
+import bisect
+import contextvars
+import functools
+import glob
+import inspect
+import json
+import os
+import threading
+import time
+import uuid
+
+PREFIX = "skolmaten_"
+
+# seconds; the upper bounds of the latency histogram buckets, +Inf implied
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+HELP = {
+    "http_request_duration_seconds": ("histogram", "Time spent in each route"),
+    "http_requests_total": ("counter", "Responses by route and status"),
+    "db_call_duration_seconds": ("histogram", "Time spent in each db coroutine"),
+    "db_call_errors_total": ("counter", "db coroutines that raised"),
+    "db_queries_total": ("counter", "SQL statements run by each db coroutine"),
+    "db_rows_total": ("counter", "Rows returned to each db coroutine"),
+    "db_connections_opened_total": ("counter", "SQLite connections opened"),
+    "db_connections_acquired_total": ("counter", "Connections borrowed from the pool"),
+    "db_writes_total": ("counter", "Writes committed or failed by the writer"),
+    "db_write_batches_total": ("counter", "Transactions the writer committed them in"),
+}
+
+
+class Span:
+    """What one request or one db call has done so far."""
+
+    __slots__ = ("name", "queries", "rows", "timings")
+
+    def __init__(self, name=None, timings=None):
+        self.name = name
+        self.queries = 0
+        self.rows = 0
+        # db function -> seconds, only kept for requests (Server-Timing)
+        self.timings = timings
+
+
+_span: contextvars.ContextVar[Span | None] = contextvars.ContextVar(
+    "metrics_span", default=None
+)
+
+
+def current() -> Span | None:
+    return _span.get()
+
+
+class Registry:
+    """Counters and histograms of this process, plus the other workers' files."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters: dict[tuple, float] = {}
+        # per key: one count per bucket (not cumulative), +Inf, sum, count
+        self.histograms: dict[tuple, list] = {}
+        self.directory = None
+        self.interval = 1.0
+        self._path = None
+        self._pid = None
+        self._dirty = False
+
+    def inc(self, name: str, labels: tuple = (), value: float = 1):
+        with self._lock:
+            key = (name, labels)
+            self.counters[key] = self.counters.get(key, 0) + value
+            self._dirty = True
+        self._ensure_flusher()
+
+    def observe(self, name: str, labels: tuple, value: float):
+        with self._lock:
+            key = (name, labels)
+            h = self.histograms.get(key)
+            if h is None:
+                h = self.histograms[key] = [0] * (len(BUCKETS) + 3)
+            h[bisect.bisect_left(BUCKETS, value)] += 1
+            h[-2] += value
+            h[-1] += 1
+            self._dirty = True
+        self._ensure_flusher()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "counters": [[n, l, v] for (n, l), v in self.counters.items()],
+                "histograms": [[n, l, list(h)] for (n, l), h in self.histograms.items()],
+            }
+
+    def configure(self, directory: str | None, interval: float = 1.0):
+        self.directory = directory or None
+        self.interval = interval
+        self._pid = None
+
+    def _ensure_flusher(self):
+        # started lazily and again after a fork, since threads don't survive one
+        if self.directory is None or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._path = os.path.join(
+                self.directory, f"{self._pid}-{uuid.uuid4().hex[:8]}.json"
+            )
+        threading.Thread(target=self._flush_forever, daemon=True).start()
+
+    def _flush_forever(self):
+        while True:
+            time.sleep(self.interval)
+            self.flush()
+
+    def flush(self):
+        """Write this worker's figures to METRICS_DIR if they changed."""
+        path = self._path
+        if path is None or not self._dirty:
+            return
+        self._dirty = False
+        data = json.dumps(self.snapshot()).encode()
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp = f"{path}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except OSError:
+            self._dirty = True
+
+    def remove(self):
+        """Delete this worker's file, when it exits."""
+        if self._pid != os.getpid():
+            return  # the file, if any, belongs to the process we forked from
+        path, self._path = self._path, None
+        if path is not None:
+            _unlink(path)
+
+    def collect(self) -> dict:
+        """This worker's live figures added to every other worker's last flush."""
+        snapshots = [self.snapshot()]
+        if self.directory is not None:
+            for path in glob.glob(os.path.join(self.directory, "*.json*")):
+                if path == self._path:
+                    continue
+                if not _alive(os.path.basename(path).split("-", 1)[0]):
+                    _unlink(path)
+                    continue
+                if path.endswith(".tmp"):
+                    continue
+                try:
+                    with open(path) as f:
+                        snapshots.append(json.load(f))
+                except (OSError, ValueError):
+                    continue  # written by a worker that died mid-replace
+
+        counters, histograms = {}, {}
+        for snap in snapshots:
+            for name, labels, value in snap["counters"]:
+                key = (name, tuple(map(tuple, labels)))
+                counters[key] = counters.get(key, 0) + value
+            for name, labels, h in snap["histograms"]:
+                key = (name, tuple(map(tuple, labels)))
+                total = histograms.setdefault(key, [0] * len(h))
+                for i, v in enumerate(h):
+                    total[i] += v
+        return {"counters": counters, "histograms": histograms}
+
+
+def _alive(pid: str) -> bool:
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except (ValueError, PermissionError):
+        pass  # not a worker's file, or someone else's process
+    return True
+
+
+def _unlink(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+registry = Registry()
+atexit.register(registry.remove)
+
+
+def _labels(labels, extra=()) -> str:
+    pairs = [*labels, *extra]
+    if not pairs:
+        return ""
+    escaped = (
+        (k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in pairs
+    )
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+def _number(value) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def render() -> str:
+    """Every metric in the Prometheus text exposition format."""
+    data = registry.collect()
+    families: dict[str, list] = {}
+    for (name, labels), value in sorted(data["counters"].items()):
+        families.setdefault(name, []).append(
+            f"{PREFIX}{name}{_labels(labels)} {_number(value)}"
+        )
+    for (name, labels), h in sorted(data["histograms"].items()):
+        lines = families.setdefault(name, [])
+        cumulative = 0
+        for bound, count in zip([*BUCKETS, "+Inf"], h):
+            cumulative += count
+            le = bound if isinstance(bound, str) else f"{bound:g}"
+            lines.append(
+                f"{PREFIX}{name}_bucket{_labels(labels, [('le', le)])} {cumulative}"
+            )
+        lines.append(f"{PREFIX}{name}_sum{_labels(labels)} {h[-2]:.6f}")
+        lines.append(f"{PREFIX}{name}_count{_labels(labels)} {h[-1]}")
+
+    out = []
+    for name in sorted(families):
+        kind, text = HELP.get(name, ("untyped", name))
+        out.append(f"# HELP {PREFIX}{name} {text}")
+        out.append(f"# TYPE {PREFIX}{name} {kind}")
+        out.extend(families[name])
+    return "\n".join(out) + "\n"
+
+
+def timed(fn):
+    """Wrap the coroutine function `fn` so every call is recorded."""
+    name = fn.__name__
+    labels = (("function", name),)
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        parent = _span.get()
+        span = Span(name)
+        token = _span.set(span)
+        start = time.perf_counter()
+        try:
+            return await fn(*args, **kwargs)
+        except BaseException:
+            registry.inc("db_call_errors_total", labels)
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            _span.reset(token)
+            registry.observe("db_call_duration_seconds", labels, elapsed)
+            if span.queries:
+                registry.inc("db_queries_total", labels, span.queries)
+            if span.rows:
+                registry.inc("db_rows_total", labels, span.rows)
+            if parent is not None:
+                parent.queries += span.queries
+                parent.rows += span.rows
+                if parent.timings is not None:
+                    parent.timings[name] = parent.timings.get(name, 0.0) + elapsed
+
+    wrapper.__wrapped_for_metrics__ = True
+    return wrapper
+
+
+def instrument(module):
+    """Replace every coroutine function defined in `module` with a timed one.
+
+    Calls between them go through the module globals, so they are timed too.
+    """
+    for name, fn in list(vars(module).items()):
+        if (
+            inspect.iscoroutinefunction(fn)
+            and fn.__module__ == module.__name__
+            and not getattr(fn, "__wrapped_for_metrics__", False)
+        ):
+            setattr(module, name, timed(fn))
+
+
+def start_request():
+    """Begin timing a request; returns what finish_request needs."""
+    span = Span(timings={})
+    _span.set(span)
+    return span, time.perf_counter()
+
+
+def finish_request(started, endpoint, method, response, server_timing=False):
+    span, start = started
+    elapsed = time.perf_counter() - start
+    _span.set(None)
+    labels = (("endpoint", endpoint or "none"), ("method", method))
+    registry.observe("http_request_duration_seconds", labels, elapsed)
+    registry.inc("http_requests_total", (*labels, ("status", response.status_code)))
+    if server_timing:
+        entries = [
+            f"{name};dur={seconds * 1000:.2f}" for name, seconds in span.timings.items()
+        ]
+        entries.append(
+            f'db;dur={sum(span.timings.values()) * 1000:.2f};'
+            f'desc="{span.queries} queries, {span.rows} rows"'
+        )
+        entries.append(f"app;dur={elapsed * 1000:.2f}")
+        response.headers.add("Server-Timing", ", ".join(entries))
+    return response
@@ -0,0 +1,360 @@
+"""Versioned schema migrations.
+
+The schema version lives in SQLite's `PRAGMA user_version`. Each entry in
+MIGRATIONS upgrades the database by one version; a database from before this
+module existed is version 0. Never edit a migration that has shipped, append
+a new one instead.
+"""
+
+
+def bump(key: str) -> str:
+    """Trigger statement that increments the version row for the SQL expression `key`."""
+    return f"""
+        INSERT INTO versions (key, version, modified)
+        VALUES ({key}, 1, (julianday('now') - 2440587.5) * 86400.0)
+        ON CONFLICT (key) DO UPDATE
+        SET version = version + 1, modified = excluded.modified;
+    """
+
+
+# full-text search: case-insensitive and folding diacritics, so "fiskgratang"
+# finds "Fiskgratäng"; prefix indexes make the "word*" queries of db.search fast
+FTS_OPTIONS = "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'"
+
+# dishes_fts rowid of (year, week, day), day 0 for monday; sorts by date
+DISH_ROWID = "{row}.year * 1000 + {row}.week * 10 + {day}"
+
+
+def index_dishes(row: str) -> list[str]:
+    """Trigger statements adding the non-empty days of weeks row `row`."""
+    return [
+        f"""
+        INSERT INTO dishes_fts (rowid, dish)
+        SELECT {DISH_ROWID.format(row=row, day=day)}, {row}.{column}
+        WHERE {row}.{column} != '';
+        """
+        for day, column in enumerate(["mon", "tue", "wed", "thu", "fri"])
+    ]
+
+
+def unindex_dishes(row: str) -> str:
+    return f"""
+        DELETE FROM dishes_fts WHERE rowid BETWEEN
+        {DISH_ROWID.format(row=row, day=0)} AND {DISH_ROWID.format(row=row, day=4)};
+    """
+
+
+# comments are indexed under their id, except soft-deleted ones
+INDEX_COMMENT = """
+    INSERT INTO comments_fts (rowid, value)
+    SELECT NEW.id, NEW.value WHERE NEW.id IS NOT NULL AND NEW.value != '<Deleted>';
+"""
+UNINDEX_COMMENT = "DELETE FROM comments_fts WHERE rowid = OLD.id;"
+
+
+def count_comment(row: str, delta: int) -> str:
+    """Trigger statement adding `delta` to the count of comments row `row`'s
+    day, unless it is soft-deleted."""
+    return f"""
+        INSERT INTO comment_counts (year, week, day, n)
+        SELECT {row}.year, {row}.week, {row}.day, {delta}
+        WHERE {row}.value IS NOT '<Deleted>'
+          AND {row}.year IS NOT NULL AND {row}.week IS NOT NULL AND {row}.day IS NOT NULL
+        ON CONFLICT (year, week, day) DO UPDATE SET n = n + excluded.n;
+        DELETE FROM comment_counts
+        WHERE year = {row}.year AND week = {row}.week AND day = {row}.day AND n = 0;
+    """
+
+
+MIGRATIONS = [
+    # 1: the original schema, so new databases and old ones end up identical
+    [
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            token TEXT,
+            id INT PRIMARY KEY UNIQUE,
+            name TEXT UNIQUE NOT NULL,
+            pass TEXT NOT NULL,
+            authlvl INTEGER DEFAULT 0,
+            display TEXT,
+            deleted INT DEFAULT 0
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS weeks (
+            week INT,
+            year INT,
+            mon TEXT,
+            tue TEXT,
+            wed TEXT,
+            thu TEXT,
+            fri TEXT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS comments (
+            week INT,
+            year INT,
+            day INT,
+            id INT PRIMARY KEY,
+            value TEXT,
+            author INT
+        )
+        """,
+    ],
+    # 2: give weeks a (year, week) key, merging any duplicate rows first
+    [
+        """
+        CREATE TABLE weeks_new (
+            week INT NOT NULL,
+            year INT NOT NULL,
+            mon TEXT,
+            tue TEXT,
+            wed TEXT,
+            thu TEXT,
+            fri TEXT,
+            PRIMARY KEY (year, week)
+        )
+        """,
+        """
+        INSERT INTO weeks_new (week, year, mon, tue, wed, thu, fri)
+        SELECT week, year, MAX(mon), MAX(tue), MAX(wed), MAX(thu), MAX(fri)
+        FROM weeks WHERE week IS NOT NULL AND year IS NOT NULL
+        GROUP BY year, week
+        """,
+        "DROP TABLE weeks",
+        "ALTER TABLE weeks_new RENAME TO weeks",
+    ],
+    # 3: secondary indexes for the lookups the views do on every request
+    [
+        "CREATE INDEX IF NOT EXISTS comments_by_day ON comments (year, week, day)",
+        "CREATE INDEX IF NOT EXISTS comments_by_author ON comments (author)",
+        "CREATE INDEX IF NOT EXISTS users_by_token ON users (token)",
+    ],
+    # 4: data versions, bumped by triggers so every write path (and every
+    # worker) invalidates cached pages. Keys are "week:<year>:<week>",
+    # "year:<year>" and "users".
+    [
+        """
+        CREATE TABLE versions (
+            key TEXT PRIMARY KEY,
+            version INTEGER NOT NULL,
+            modified REAL NOT NULL
+        )
+        """,
+        *[
+            f"""
+            CREATE TRIGGER {table}_{event.lower()}_bumps_version
+            AFTER {event} ON {table}
+            BEGIN
+                {bump(f"'week:' || {row}.year || ':' || {row}.week")}
+                {bump(f"'year:' || {row}.year")}
+            END
+            """
+            for table in ["weeks", "comments"]
+            for event, row in [("INSERT", "NEW"), ("UPDATE", "NEW"), ("DELETE", "OLD")]
+        ],
+        *[
+            f"""
+            CREATE TRIGGER users_{event.split()[0].lower()}_bumps_version
+            AFTER {event} ON users
+            BEGIN
+                {bump("'users'")}
+            END
+            """
+            for event in ["INSERT", "UPDATE OF name, display, authlvl, deleted", "DELETE"]
+        ],
+    ],
+    # 5: a version for the comments table as a whole, for /comments/all
+    [
+        f"""
+        CREATE TRIGGER comments_{event.lower()}_bumps_comments_version
+        AFTER {event} ON comments
+        BEGIN
+            {bump("'comments'")}
+        END
+        """
+        for event in ["INSERT", "UPDATE", "DELETE"]
+    ],
+    # 6: full-text indexes of every day's dish and every comment, for search
+    [
+        f"CREATE VIRTUAL TABLE dishes_fts USING fts5 (dish, {FTS_OPTIONS})",
+        f"CREATE VIRTUAL TABLE comments_fts USING fts5 (value, {FTS_OPTIONS})",
+        *[
+            f"""
+            INSERT INTO dishes_fts (rowid, dish)
+            SELECT {DISH_ROWID.format(row="weeks", day=day)}, {column}
+            FROM weeks WHERE {column} != ''
+            """
+            for day, column in enumerate(["mon", "tue", "wed", "thu", "fri"])
+        ],
+        """
+        INSERT INTO comments_fts (rowid, value)
+        SELECT id, value FROM comments
+        WHERE id IS NOT NULL AND value != '<Deleted>'
+        """,
+        f"""
+        CREATE TRIGGER weeks_insert_indexes_dishes AFTER INSERT ON weeks
+        BEGIN
+            {"".join(index_dishes("NEW"))}
+        END
+        """,
+        f"""
+        CREATE TRIGGER weeks_update_indexes_dishes AFTER UPDATE ON weeks
+        BEGIN
+            {unindex_dishes("OLD")}
+            {"".join(index_dishes("NEW"))}
+        END
+        """,
+        f"""
+        CREATE TRIGGER weeks_delete_indexes_dishes AFTER DELETE ON weeks
+        BEGIN
+            {unindex_dishes("OLD")}
+        END
+        """,
+        f"""
+        CREATE TRIGGER comments_insert_indexes_comments AFTER INSERT ON comments
+        BEGIN
+            {INDEX_COMMENT}
+        END
+        """,
+        f"""
+        CREATE TRIGGER comments_update_indexes_comments AFTER UPDATE OF id, value ON comments
+        BEGIN
+            {UNINDEX_COMMENT}
+            {INDEX_COMMENT}
+        END
+        """,
+        f"""
+        CREATE TRIGGER comments_delete_indexes_comments AFTER DELETE ON comments
+        BEGIN
+            {UNINDEX_COMMENT}
+        END
+        """,
+    ],
+    # 7: comments per day, not counting soft-deleted ones, for the badges on
+    # the week and year pages; `python -m skolmaten.consistency` checks it
+    [
+        """
+        CREATE TABLE comment_counts (
+            year INT NOT NULL,
+            week INT NOT NULL,
+            day INT NOT NULL,
+            n INTEGER NOT NULL,
+            PRIMARY KEY (year, week, day)
+        ) WITHOUT ROWID
+        """,
+        """
+        INSERT INTO comment_counts (year, week, day, n)
+        SELECT year, week, day, COUNT(*) FROM comments
+        WHERE value IS NOT '<Deleted>'
+          AND year IS NOT NULL AND week IS NOT NULL AND day IS NOT NULL
+        GROUP BY year, week, day
+        """,
+        f"""
+        CREATE TRIGGER comments_insert_counts_comment AFTER INSERT ON comments
+        BEGIN
+            {count_comment("NEW", 1)}
+        END
+        """,
+        f"""
+        CREATE TRIGGER comments_update_counts_comment
+        AFTER UPDATE OF year, week, day, value ON comments
+        BEGIN
+            {count_comment("OLD", -1)}
+            {count_comment("NEW", 1)}
+        END
+        """,
+        f"""
+        CREATE TRIGGER comments_delete_counts_comment AFTER DELETE ON comments
+        BEGIN
+            {count_comment("OLD", -1)}
+        END
+        """,
+    ],
+    # 8: a version per year of the weeks table alone, which comments don't
+    # bump, for the in-memory menu store. Key "menu:<year>".
+    [
+        f"""
+        CREATE TRIGGER weeks_{event.lower()}_bumps_menu_version
+        AFTER {event} ON weeks
+        BEGIN
+            {bump(f"'menu:' || {row}.year")}
+        END
+        """
+        for event, row in [("INSERT", "NEW"), ("UPDATE", "NEW"), ("DELETE", "OLD")]
+    ],
+    # 9: a version per user, so every worker drops its cached token lookups
+    # (db.user_by_token) of a user who is renamed, demoted, deleted or has
+    # their token revoked. Issuing a new token at sign-in doesn't bump it.
+    # Key "user:<id>".
+    [
+        f"""
+        CREATE TRIGGER users_update_bumps_user_version
+        AFTER UPDATE OF name, display, authlvl, deleted ON users
+        BEGIN
+            {bump("'user:' || NEW.id")}
+        END
+        """,
+        f"""
+        CREATE TRIGGER users_revoke_bumps_user_version
+        AFTER UPDATE OF token ON users
+        WHEN NEW.token IS NULL OR NEW.token = ''
+        BEGIN
+            {bump("'user:' || NEW.id")}
+        END
+        """,
+        f"""
+        CREATE TRIGGER users_delete_bumps_user_version
+        AFTER DELETE ON users
+        BEGIN
+            {bump("'user:' || OLD.id")}
+        END
+        """,
+    ],
+]
+
+
+async def schema_version(db) -> int:
+    async with db.execute("PRAGMA user_version") as cursor:
+        return (await cursor.fetchone())[0]
+
+
+# how long a worker waits for another one's migrations, which on a big
+# database (the backfills of 6 and 7) take far longer than busy_timeout
+MIGRATION_TIMEOUT_MS = 30 * 60 * 1000
+
+
+async def migrate(db) -> int:
+    """Bring the database up to the latest version and return that version.
+
+    Safe to call from several workers at once: the upgrade runs inside one
+    `BEGIN IMMEDIATE` transaction, so the first worker takes the write lock
+    and the others wait for it, re-read the version and find nothing left
+    to do.
+    """
+    if await schema_version(db) >= len(MIGRATIONS):
+        return len(MIGRATIONS)
+
+    # the long timeout is only for taking the write lock; it is back to the
+    # usual one before any migration runs, so a migration that blocks on
+    # something else still fails fast
+    async with db.execute("PRAGMA busy_timeout") as cursor:
+        (timeout,) = await cursor.fetchone()
+    await db.execute(f"PRAGMA busy_timeout = {MIGRATION_TIMEOUT_MS}")
+    try:
+        await db.execute("BEGIN IMMEDIATE")
+    finally:
+        await db.execute(f"PRAGMA busy_timeout = {int(timeout)}")
+    try:
+        version = await schema_version(db)
+        for statements in MIGRATIONS[version:]:
+            for sql in statements:
+                await db.execute(sql)
+        # PRAGMA doesn't take parameters; len() is always a plain int
+        await db.execute(f"PRAGMA user_version = {len(MIGRATIONS)}")
+        await db.commit()
+    except BaseException:
+        await db.rollback()
+        raise
+    return len(MIGRATIONS)
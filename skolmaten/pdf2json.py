@@ -1,12 +1,23 @@
+import datetime
 import json
+import os
 import re
 import sys
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 
 from PyPDF2 import PdfReader
 
+if __package__:
+    from . import pdfcache
+else:
+    # run as a script, python pdf2json.py menu.pdf menu.json
+    import pdfcache
+
 week_re = re.compile(r"V\.\s*(\d+)")
 day_re = re.compile(r"^(Mån|Tis|Ons|Tor|Fre)\s+(\d+/\d+)\s+(.*)")
+space_re = re.compile(r"\s+")
+space_before_punct_re = re.compile(r"\s+([,:;])")
 
 days_map = {
     "Mån": "mon",
@@ -16,54 +27,165 @@ days_map = {
     "Fre": "fri",
 }
 
+# below this many pages starting worker processes costs more than it saves
+MIN_PARALLEL_PAGES = 4
 
-def parse_pdf(path):
-    text = ""
-    reader = PdfReader(path)
-    for page in reader.pages:
-        text += page.extract_text() + "\n"
-    return text
+# the PdfReader of a worker process, opened once by _open_reader
+_reader = None
 
 
-def parse_menu(text, year=2025):
-    data = defaultdict(lambda: defaultdict(dict))
-    current_week = None
+def _open_reader(path):
+    global _reader
+    _reader = PdfReader(path)
+
+
+def _extract_page(index):
+    return _reader.pages[index].extract_text()
+
+
+def _extract(path, reader, indices, workers):
+    """Yield the text of pages `indices` of `reader`, in that order."""
+    workers = min(workers or os.cpu_count() or 1, len(indices))
+    if workers <= 1 or len(indices) < MIN_PARALLEL_PAGES:
+        for index in indices:
+            yield reader.pages[index].extract_text()
+        return
+
+    with ProcessPoolExecutor(
+        workers, initializer=_open_reader, initargs=(path,)
+    ) as executor:
+        yield from executor.map(_extract_page, indices)
 
-    lines = text.splitlines()
-    for line in lines:
-        line = line.strip()
-        if not line:
-            continue
 
-        # Update week
-        week_match = week_re.search(line)
-        if week_match:
-            current_week = int(week_match.group(1))
+def extract_pages(path, workers=None, cache=True):
+    """Yield the text of every page of the PDF at `path`, in order.
+
+    Pages are extracted on a pool of `workers` processes (default: one per
+    CPU) and each is yielded as soon as it and the pages before it are done.
+    Pages already in the cache (see pdfcache) are not extracted again;
+    `cache` is a pdfcache.Cache, True for the default one or False for none.
+    """
+    if cache is True:
+        cache = pdfcache.Cache()
+    if not cache:
+        reader = PdfReader(path)
+        yield from _extract(path, reader, range(len(reader.pages)), workers)
+        return
+
+    key = pdfcache.file_key(path)
+    keys = cache.pages_of(key)
+    if keys is not None:
+        texts = [cache.text(page_key) for page_key in keys]
+        if None not in texts:
+            yield from texts
+            return
+
+    reader = PdfReader(path)
+    keys = pdfcache.page_keys(reader)
+    texts = [cache.text(page_key) for page_key in keys]
+    extracted = _extract(
+        path, reader, [i for i, text in enumerate(texts) if text is None], workers
+    )
+    for page_key, text in zip(keys, texts):
+        if text is None:
+            text = next(extracted)
+            cache.set_text(page_key, text)
+        yield text
+    cache.set_pages_of(key, keys)
+    cache.trim()
+
+
+def parse_pdf(path, workers=None, cache=True):
+    return "".join(text + "\n" for text in extract_pages(path, workers, cache))
+
+
+def infer_year(week, weekday, date_str, around):
+    """The ISO year, within a year of `around`, whose `week` has `date_str`
+    ("day/month") on `weekday` (1 for monday), or None if none does."""
+    try:
+        day, month = map(int, date_str.split("/"))
+    except ValueError:
+        return None
+    for year in (around, around - 1, around + 1):
+        try:
+            date = datetime.date.fromisocalendar(year, week, weekday)
+        except ValueError:
             continue
+        if (date.day, date.month) == (day, month):
+            return year
+    return None
+
 
-        # Parse day lines
-        day_match = day_re.match(line)
-        if day_match and current_week:
-            day_sv, date_str, dish_text = day_match.groups()
-            dish_text = re.sub(r"\s+", " ", dish_text)
-            dish_text = re.sub(r"\s+([,:;])", r"\1", dish_text)
-            dish_text = dish_text.strip()
-            day_en = days_map[day_sv]
-            data[str(year)][current_week][day_en] = dish_text
+def iter_menu(pages, year=2025, around=None):
+    """Yield (year, week, day, dish) from page texts as they arrive.
 
+    `day` is "mon".."fri" and `year` a string, as in parse_menu's output.
+    With `year=None` the year of each day is inferred from its printed date
+    instead (see infer_year; `around` defaults to this year), so a menu
+    running from December into January comes out right. Days whose date
+    doesn't fit any year get the year of the day before, moved on by one
+    when the week numbers start over.
+    """
+    current_week = None
+    around = around or datetime.date.today().year
+    last_year, last_week = around, None
+
+    for text in pages:
+        for line in text.splitlines():
+            line = line.strip()
+            if not line:
+                continue
+
+            # Update week
+            week_match = week_re.search(line)
+            if week_match:
+                current_week = int(week_match.group(1))
+                continue
+
+            # Parse day lines
+            day_match = day_re.match(line)
+            if day_match and current_week:
+                day_sv, date_str, dish_text = day_match.groups()
+                dish_text = space_re.sub(" ", dish_text)
+                dish_text = space_before_punct_re.sub(r"\1", dish_text)
+                dish_text = dish_text.strip()
+                day_en = days_map[day_sv]
+                if year is not None:
+                    yield str(year), current_week, day_en, dish_text
+                    continue
+
+                weekday = list(days_map).index(day_sv) + 1
+                inferred = infer_year(current_week, weekday, date_str, around)
+                if inferred is None:
+                    inferred = last_year
+                    if last_week is not None and current_week < last_week - 26:
+                        inferred += 1
+                last_year, last_week = inferred, current_week
+                yield str(inferred), current_week, day_en, dish_text
+
+
+def parse_menu(text, year=2025):
+    """{year: {week: {day: dish}}} from the whole text or an iterable of pages."""
+    data = defaultdict(lambda: defaultdict(dict))
+    for year, week, day, dish in iter_menu(
+        [text] if isinstance(text, str) else text, year
+    ):
+        data[year][week][day] = dish
     return data
 
 
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print("Usage: python parse_menu.py input.pdf output.json")
+    args = [arg for arg in sys.argv[1:] if arg != "--no-cache"]
+    if len(args) != 2:
+        print("Usage: python pdf2json.py [--no-cache] input.pdf output.json")
         sys.exit(1)
 
-    input_path = sys.argv[1]
-    output_path = sys.argv[2]
+    input_path = args[0]
+    output_path = args[1]
 
-    pdf_text = parse_pdf(input_path)
-    parsed = parse_menu(pdf_text)
+    parsed = parse_menu(
+        extract_pages(input_path, cache="--no-cache" not in sys.argv[1:])
+    )
 
     with open(output_path, "w", encoding="utf-8") as f:
         json.dump(parsed, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,151 @@
+"""On-disk cache of extracted PDF page text.
+
+Text is stored per page under a hash of everything on the page that the
+extraction reads: its content streams, fonts and other resources, page box
+and rotation. A revised menu that only changes a few weeks therefore only
+has those pages extracted again. Each PDF also gets an entry under the
+SHA-256 of the whole file listing its page hashes, so a file seen before is
+answered without parsing it at all.
+
+The cache lives in $PDF_CACHE_DIR (default ~/.cache/skolmaten/pdf) and is
+trimmed to $PDF_CACHE_MB megabytes (default 64), least recently used first.
+"""
+
+import hashlib
+import json
+import os
+
+import PyPDF2
+from PyPDF2.generic import IndirectObject, StreamObject
+
+# the text PyPDF2 extracts changes between versions, so its cache does too
+VERSION = f"1:{PyPDF2.__version__}"
+
+# page keys that can't change the text, or that point out of the page
+IGNORED_KEYS = {"/Parent", "/Annots", "/Thumb", "/B", "/StructParents"}
+
+
+def default_directory() -> str:
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.environ.get("PDF_CACHE_DIR") or os.path.join(base, "skolmaten", "pdf")
+
+
+def file_key(path: str) -> str:
+    digest = hashlib.sha256(VERSION.encode())
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def page_keys(reader) -> list[str]:
+    """A key per page of `reader` that changes whenever its text could."""
+    memo = {}
+    keys = []
+    for page in reader.pages:
+        digest = hashlib.sha256(VERSION.encode())
+        for key in sorted(page):
+            if key not in IGNORED_KEYS:
+                digest.update(key.encode())
+                digest.update(_object_digest(dict.__getitem__(page, key), memo))
+        keys.append(digest.hexdigest())
+    return keys
+
+
+def _object_digest(obj, memo) -> bytes:
+    """A digest of `obj` and everything it refers to.
+
+    Indirect objects are hashed by content rather than by object number,
+    and only once per document, so fonts shared by every page cost nothing
+    after the first.
+    """
+    if isinstance(obj, IndirectObject):
+        ref = (obj.idnum, obj.generation)
+        if ref not in memo:
+            memo[ref] = b"cycle"  # an object reachable from itself
+            memo[ref] = _object_digest(obj.get_object(), memo)
+        return memo[ref]
+
+    digest = hashlib.sha256(type(obj).__name__.encode())
+    if isinstance(obj, dict):
+        for key in sorted(obj):
+            digest.update(str(key).encode())
+            digest.update(_object_digest(dict.__getitem__(obj, key), memo))
+        if isinstance(obj, StreamObject):
+            digest.update(obj.get_data())
+    elif isinstance(obj, list):
+        for item in obj:
+            digest.update(_object_digest(item, memo))
+    else:
+        digest.update(repr(obj).encode())
+    return digest.digest()
+
+
+class Cache:
+    def __init__(self, directory: str | None = None, max_bytes: int | None = None):
+        self.directory = directory or default_directory()
+        if max_bytes is None:
+            max_bytes = int(float(os.environ.get("PDF_CACHE_MB", 64)) * (1 << 20))
+        self.max_bytes = max_bytes
+
+    def _path(self, key: str, kind: str) -> str:
+        return os.path.join(self.directory, f"{key}.{kind}")
+
+    def _read(self, path: str) -> str | None:
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = f.read()
+            os.utime(path)  # recently used, for trim
+        except OSError:
+            return None
+        return data
+
+    def _write(self, path: str, data: str):
+        # named after the process so concurrent writers never share a file
+        tmp = f"{path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except OSError:
+            pass  # an unwritable cache only means extracting again
+
+    def pages_of(self, key: str) -> list[str] | None:
+        data = self._read(self._path(key, "json"))
+        return json.loads(data) if data is not None else None
+
+    def set_pages_of(self, key: str, page_keys: list[str]):
+        self._write(self._path(key, "json"), json.dumps(page_keys))
+
+    def text(self, key: str) -> str | None:
+        return self._read(self._path(key, "txt"))
+
+    def set_text(self, key: str, text: str):
+        self._write(self._path(key, "txt"), text)
+
+    def trim(self):
+        """Delete the least recently used entries until under max_bytes."""
+        try:
+            entries = [
+                entry
+                for entry in os.scandir(self.directory)
+                if entry.name.endswith((".json", ".txt"))
+            ]
+        except OSError:
+            return
+        stats = []
+        for entry in entries:
+            try:
+                stats.append((entry.stat(), entry.path))
+            except OSError:
+                pass
+        total = sum(stat.st_size for stat, _ in stats)
+        for stat, path in sorted(stats, key=lambda s: s[0].st_mtime):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= stat.st_size
@@ -0,0 +1,427 @@
+import asyncio
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import asynccontextmanager
+from functools import partial
+from urllib.request import pathname2url
+
+import aiosqlite
+
+from . import metrics, slowlog
+
+# applied once to every connection when it is opened
+PRAGMAS = [
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA temp_store = MEMORY",
+    # in WAL mode NORMAL only syncs at checkpoints; a power cut can lose the
+    # last commits but never corrupts the database
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -16384",  # KiB
+    "PRAGMA mmap_size = 268435456",
+    # the -wal file is truncated back to this after a checkpoint
+    "PRAGMA journal_size_limit = 67108864",
+]
+
+
+def sqlite_connect(path: str, readonly: bool = False, **kwargs) -> sqlite3.Connection:
+    """sqlite3.connect with the slow-query log; `readonly` opens it mode=ro."""
+    if readonly:
+        path = f"file:{pathname2url(os.path.abspath(path))}?mode=ro"
+    return sqlite3.connect(
+        path, factory=slowlog.TimedConnection, uri=readonly, **kwargs
+    )
+
+
+class VersionWatch:
+    """Rows of the versions table, cheap enough to check on every request.
+
+    A row is only read again once `PRAGMA data_version` on the watch's own
+    read-only connection says some connection, in this process or another,
+    has committed since it was last read; SQLite answers that from the WAL
+    index in shared memory.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+        self._data_version = None
+        self._versions: dict[str, int] = {}
+
+    def current(self, key: str) -> int:
+        with self._lock:
+            if self._pid != os.getpid():
+                # a connection must not cross a fork
+                self._pid = os.getpid()
+                self._conn = sqlite_connect(
+                    self.path, readonly=True, check_same_thread=False
+                )
+                self._data_version = None
+            (data_version,) = self._conn.execute("PRAGMA data_version").fetchone()
+            if data_version != self._data_version:
+                self._data_version = data_version
+                self._versions.clear()
+            version = self._versions.get(key)
+            if version is None:
+                row = self._conn.execute(
+                    "SELECT version FROM versions WHERE key = ?", (key,)
+                ).fetchone()
+                version = self._versions[key] = row[0] if row else 0
+            return version
+
+
+class Pool:
+    """A process-wide pool of long-lived aiosqlite connections.
+
+    Connections are handed out one caller at a time and kept open between
+    requests, so a page render no longer starts a new thread and reopens the
+    database file for every query. The pool is guarded by a thread lock rather
+    than asyncio primitives because Flask runs every async view on its own
+    event loop.
+    """
+
+    def __init__(self, path: str, size: int = 8, readonly: bool = False):
+        self.path = path
+        self.size = size
+        self.readonly = readonly
+        self._idle: list[aiosqlite.Connection] = []
+        self._lock = threading.Lock()
+        # connection -> [statements, rows] run on it, for metrics spans
+        self._counts: dict[aiosqlite.Connection, list[int]] = {}
+        self.opened = 0
+        self.acquired = 0
+        self.queries = 0
+
+    async def _open(self, readonly: bool) -> aiosqlite.Connection:
+        # `_thread` here and `_conn` below are aiosqlite internals, which is
+        # why requirements.txt pins it
+        conn = aiosqlite.Connection(partial(sqlite_connect, self.path, readonly), 64)
+        # idle connections must not keep a gunicorn worker from exiting
+        conn._thread.daemon = True
+        await conn
+        for pragma in PRAGMAS:
+            await conn.execute(pragma)
+        counts = [0, 0]
+        await conn.set_trace_callback(partial(self._count_query, counts))
+        conn.row_factory = partial(_count_row, counts)
+        with self._lock:
+            self.opened += 1
+            self._counts[conn] = counts
+        metrics.registry.inc("db_connections_opened_total")
+        return conn
+
+    @asynccontextmanager
+    async def connection(self):
+        with self._lock:
+            self.acquired += 1
+            conn = self._idle.pop() if self._idle else None
+        if conn is None:
+            conn = await self._open(self.readonly)
+        metrics.registry.inc("db_connections_acquired_total")
+
+        counts = self._counts[conn]
+        queries, rows = counts
+        span = metrics.current()
+        # the connection's thread is idle, so this is safe to set from here
+        conn._conn.caller = span.name if span is not None else None
+        try:
+            yield conn
+        finally:
+            if span is not None:
+                span.queries += counts[0] - queries
+                span.rows += counts[1] - rows
+            await self._release(conn)
+
+    @asynccontextmanager
+    async def writable(self):
+        """A writable connection of its own, closed afterwards, for schema
+        changes; everything else writes through the Writer."""
+        conn = await self._open(False)
+        try:
+            yield conn
+        finally:
+            await self._discard(conn)
+
+    def _count_query(self, counts: list[int], sql: str):
+        # runs on the connection's own thread
+        counts[0] += 1
+        with self._lock:
+            self.queries += 1
+
+    async def _release(self, conn: aiosqlite.Connection):
+        try:
+            if conn.in_transaction:
+                # never hand out a connection with someone else's open transaction
+                await conn.rollback()
+        except Exception:
+            await self._discard(conn)
+            return
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(conn)
+                return
+        await self._discard(conn)
+
+    async def _discard(self, conn: aiosqlite.Connection):
+        with self._lock:
+            self._counts.pop(conn, None)
+        try:
+            await conn.close()
+        except Exception:
+            pass
+
+    async def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            await self._discard(conn)
+
+    def stats(self) -> dict:
+        return {
+            "opened": self.opened,
+            "acquired": self.acquired,
+            "queries": self.queries,
+        }
+
+
+class Writer:
+    """The one connection every write of this process goes through.
+
+    Callers hand over a function that does its writes on a plain sqlite3
+    connection, on the writer's own thread. Writes that queue up while a
+    batch is committing, or arrive within `window` seconds of the first one,
+    share one transaction and so one fsync, and none of them waits on
+    SQLite's write lock behind another writer in the same process. Each
+    write runs in a savepoint, so one that raises is undone on its own and
+    its caller gets the exception while the rest of the batch commits.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        window: float = 0.0,
+        max_batch: int = 256,
+        wal_limit: int = 64 << 20,
+    ):
+        self.path = path
+        self.window = window
+        self.max_batch = max_batch
+        # bytes of -wal file after which the writer forces a checkpoint
+        self.wal_limit = wal_limit
+        self._next_checkpoint = 0.0
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        # why the thread stopped, if it couldn't open the database
+        self._error = None
+        self.writes = 0
+        self.batches = 0
+        self.failed = 0
+        self.checkpoints = 0
+        # called on the writer thread after every batch that committed
+        self.listeners = []
+
+    def submit(self, fn, *args) -> Future:
+        """Queue `fn(conn, *args)`; the future resolves once it is committed.
+
+        Its result is (return value, statements run, rows read).
+        """
+        self._ensure_thread()
+        future = Future()
+        span = metrics.current()
+        with self._lock:
+            if self._error is not None:
+                raise self._dead()
+            self._queue.put(
+                (fn, args, future, span.name if span is not None else None)
+            )
+        return future
+
+    async def write(self, fn, *args):
+        """Run `fn(conn, *args)` in the next batch and return its result."""
+        value, queries, rows = await asyncio.wrap_future(self.submit(fn, *args))
+        span = metrics.current()
+        if span is not None:
+            span.queries += queries
+            span.rows += rows
+        return value
+
+    def _ensure_thread(self):
+        # started lazily and again after a fork, since threads don't survive one
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._queue = queue.SimpleQueue()
+            self._error = None
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def _connect(self):
+        conn = sqlite_connect(self.path, isolation_level=None, check_same_thread=False)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        counts = [0, 0]
+        conn.set_trace_callback(lambda sql: _count_statement(counts))
+        conn.row_factory = partial(_count_row, counts)
+        return conn, counts
+
+    def _dead(self) -> RuntimeError:
+        error = RuntimeError(f"the writer for {self.path} stopped: {self._error}")
+        error.__cause__ = self._error
+        return error
+
+    def _fail(self, error: Exception):
+        """Stop taking writes and fail every one that is queued."""
+        with self._lock:
+            self._error = error
+            while True:
+                try:
+                    job = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if job is not None:
+                    job[2].set_exception(self._dead())
+
+    def _run(self):
+        try:
+            conn, counts = self._connect()
+        except Exception as e:
+            # otherwise every write would wait forever for a thread that
+            # is gone
+            self._fail(e)
+            return
+        metrics.registry.inc("db_connections_opened_total")
+        stop = False
+        while not stop:
+            job = self._queue.get()
+            if job is None:
+                break
+            batch = [job]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                try:
+                    job = (
+                        self._queue.get(timeout=timeout)
+                        if timeout > 0
+                        else self._queue.get_nowait()
+                    )
+                except queue.Empty:
+                    break
+                if job is None:
+                    stop = True
+                    break
+                batch.append(job)
+            self._commit(conn, counts, batch)
+            self._checkpoint(conn)
+        conn.close()
+
+    def _commit(self, conn, counts, batch):
+        outcomes = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for fn, args, future, caller in batch:
+                conn.caller = caller
+                queries, rows = counts
+                conn.execute("SAVEPOINT write")
+                try:
+                    value = fn(conn, *args)
+                except Exception as e:
+                    conn.execute("ROLLBACK TO write")
+                    outcomes.append((future, None, e))
+                else:
+                    outcomes.append(
+                        (future, (value, counts[0] - queries, counts[1] - rows), None)
+                    )
+                conn.execute("RELEASE write")
+            conn.execute("COMMIT")
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            outcomes = [(future, None, e) for _, _, future, _ in batch]
+        else:
+            for listener in self.listeners:
+                try:
+                    listener()
+                except Exception:
+                    pass
+
+        self.batches += 1
+        self.writes += len(batch)
+        metrics.registry.inc("db_write_batches_total")
+        metrics.registry.inc("db_writes_total", (), len(batch))
+        for future, result, error in outcomes:
+            if error is not None:
+                self.failed += 1
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def _checkpoint(self, conn):
+        """Keep the -wal file from growing without bound.
+
+        SQLite checkpoints on its own every 1000 pages, but only as far as
+        the oldest open read allows, so under a steady stream of readers the
+        file can keep growing. Past `wal_limit` the writer waits briefly
+        for readers to finish and truncates it, at most once a second.
+        """
+        now = time.monotonic()
+        if not self.wal_limit or now < self._next_checkpoint:
+            return
+        try:
+            if os.path.getsize(self.path + "-wal") < self.wal_limit:
+                return
+        except OSError:
+            return
+        self._next_checkpoint = now + 1.0
+        conn.execute("PRAGMA busy_timeout = 100")
+        try:
+            busy, _, _ = conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+            if not busy:
+                self.checkpoints += 1
+        except sqlite3.Error:
+            pass
+        finally:
+            conn.execute(PRAGMAS[0])
+
+    def close(self):
+        """Commit what is queued and stop the thread."""
+        if self._thread is not None and self._pid == os.getpid():
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = self._pid = None
+
+    def stats(self) -> dict:
+        return {
+            "writes": self.writes,
+            "batches": self.batches,
+            "failed": self.failed,
+            "checkpoints": self.checkpoints,
+        }
+
+
+def _count_statement(counts: list[int]):
+    counts[0] += 1
+
+
+def _count_row(counts: list[int], cursor, row):
+    # sqlite3 row factory that leaves rows as plain tuples; runs on the
+    # connection's own thread
+    counts[1] += 1
+    return row
+
+
+def shutdown(pool: Pool, writer: Writer):
+    """Commit queued writes and close every idle connection; registered as an
+    exit hook by db.init_app."""
+    writer.close()
+    asyncio.run(pool.close())
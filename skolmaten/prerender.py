@@ -0,0 +1,204 @@
+"""Static snapshots of the pages anonymous visitors see.
+
+With PRERENDER_DIR set, the menu pages as they look without a login are
+written there as plain HTML for a reverse proxy to serve without asking the
+app at all:
+
+    index.html               /
+    week/<year>/<week>.html  /week/<week>?year=<year>, PRERENDER_WEEKS
+                             either side of the current week
+    year/<year>.html         /year/<year>, for every year with a menu
+
+Each snapshot remembers the data versions (see db.get_versions) it was
+rendered from, so a pass only renders again what a write touched: a new
+dish or comment in one week redoes that week's page, its year's page and
+perhaps index.html. At the friday noon rollover everything is redone, since
+every page links to the current week. Passes run on a thread in every
+worker, started by its first request: right after each of its writes
+commits, and every PRERENDER_INTERVAL seconds for writes made elsewhere. A
+lock file keeps two from overlapping.
+
+    python -m skolmaten.prerender   # one pass, e.g. from cron
+"""
+
+import datetime
+import fcntl
+import json
+import logging
+import os
+import threading
+
+from . import assets, db
+from . import app as views
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = ".manifest.json"
+
+
+class Prerenderer:
+    def __init__(
+        self, app, directory: str, url: str, weeks: int = 4, interval: float = 5.0
+    ):
+        self.app = app
+        self.directory = directory
+        # the public address, which the pages' links are built on
+        self.url = url
+        self.weeks = weeks
+        self.interval = interval
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self.passes = 0
+        self.rendered = 0
+
+    def start(self):
+        # started again after a fork, since threads don't survive one
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._wake = threading.Event()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def wake(self):
+        """Run a pass soon; called after every write of this process."""
+        self.start()
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception("pre-rendering failed")
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def pages(self) -> dict:
+        """path -> (url, version keys it is rendered from) for every snapshot."""
+        curweek, curyear = views.calculate_closest_week()
+        # / shows the current week of the calendar year, as app.root does
+        today = datetime.date.today()
+        pages = {
+            "index.html": ("/", [db.week_key(today.year, curweek)]),
+        }
+        monday = datetime.date.fromisocalendar(curyear, curweek, 1)
+        for n in range(-self.weeks, self.weeks + 1):
+            year, week, _ = (monday + datetime.timedelta(weeks=n)).isocalendar()
+            pages[f"week/{year}/{week}.html"] = (
+                f"/week/{week}?year={year}",
+                [db.week_key(year, week)],
+            )
+        for year in self.app.ensure_sync(db.menu_years)() | {curyear}:
+            pages[f"year/{year}.html"] = (f"/year/{year}", [db.year_key(year)])
+        return pages
+
+    def run_once(self) -> int:
+        """Render every snapshot that is missing or out of date; returns how
+        many were. Does nothing if another process is in a pass already."""
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, ".lock"), "w") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return 0
+            return self._render_changed()
+
+    def _render_changed(self) -> int:
+        manifest_path = os.path.join(self.directory, MANIFEST)
+        try:
+            with open(manifest_path, encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            manifest = {}
+        old = manifest.get("pages", {})
+
+        pages = self.pages()
+        closest = list(views.calculate_closest_week())
+        keys = {key for _, deps in pages.values() for key in deps}
+        versions = self.app.ensure_sync(db.get_versions)(*keys)
+        everything = manifest.get("closest") != closest
+
+        rendered, count = {}, 0
+        for path, (url, deps) in pages.items():
+            current = [versions[key][0] for key in deps]
+            if (
+                not everything
+                and old.get(path) == current
+                and os.path.exists(os.path.join(self.directory, path))
+            ):
+                rendered[path] = current
+            elif self._render(path, url):
+                rendered[path] = current
+                count += 1
+
+        for path in old.keys() - pages.keys():
+            # out of the window now, so the proxy passes it to the app again
+            try:
+                os.remove(os.path.join(self.directory, path))
+            except OSError:
+                pass
+
+        if count or old.keys() != rendered.keys():
+            assets.write_atomic(
+                manifest_path,
+                json.dumps({"closest": closest, "pages": rendered}).encode(),
+            )
+        self.passes += 1
+        self.rendered += count
+        return count
+
+    def _render(self, path: str, url: str) -> bool:
+        with self.app.test_request_context(url, base_url=self.url):
+            response = self.app.full_dispatch_request()
+        if response.status_code != 200:
+            logger.warning("not pre-rendering %s: %s", url, response.status)
+            return False
+        assets.write_atomic(os.path.join(self.directory, path), response.get_data())
+        return True
+
+    def stats(self) -> dict:
+        return {"passes": self.passes, "rendered": self.rendered}
+
+
+# set up by init_app when PRERENDER_DIR is set
+prerenderer: Prerenderer | None = None
+
+
+def init_app(app):
+    global prerenderer
+    directory = app.config.get("PRERENDER_DIR")
+    if not directory:
+        return
+    if not app.config.get("PRERENDER_URL"):
+        raise RuntimeError(
+            "PRERENDER_DIR needs PRERENDER_URL, the site's public address"
+        )
+    prerenderer = Prerenderer(
+        app,
+        directory,
+        app.config["PRERENDER_URL"],
+        app.config.get("PRERENDER_WEEKS", 4),
+        app.config.get("PRERENDER_INTERVAL", 5.0),
+    )
+    db.writer.listeners.append(prerenderer.wake)
+    # the first request starts the thread, so a worker's first pass happens
+    # in the worker and not in a gunicorn master that is about to fork
+    app.before_request(prerenderer.start)
+
+
+if __name__ == "__main__":
+    # run as __main__, so the instance create_app sets up is on the package's
+    # copy of this module
+    from skolmaten import create_app, prerender
+
+    create_app()
+    if prerender.prerenderer is None:
+        raise SystemExit("set PRERENDER_DIR and PRERENDER_URL")
+    count = prerender.prerenderer.run_once()
+    print(f"rendered {count} pages into {prerender.prerenderer.directory}")
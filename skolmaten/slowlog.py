@@ -0,0 +1,275 @@
+"""Slow-query log with the query plan of every slow statement.
+
+Pooled connections time each statement on their own thread, from execute
+until its cursor is read to the end, closed or re-used, so the time spent
+fetching rows counts too. Statements slower than SLOW_QUERY_MS are logged
+as a warning with the db function that ran them, the types of their
+parameters (never the values) and their EXPLAIN QUERY PLAN, so a full scan
+of weeks or comments stands out straight away. With SLOW_QUERY_LOG set every entry is
+also appended there as a JSON line, which this module can replay against a
+copy of the database to see the plans an index change would give:
+
+    SLOW_QUERY_MS=0 SLOW_QUERY_LOG=queries.jsonl gunicorn ...
+    python -m skolmaten.slowlog queries.jsonl copy-of-production.db
+"""
+
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from urllib.request import pathname2url
+
+logger = logging.getLogger("skolmaten.slowquery")
+
+# statements at least this slow are logged; 0 logs every statement
+threshold = 0.1
+capture_path = None
+_capture_lock = threading.Lock()
+
+
+def configure(threshold_ms: float = 100, path: str | None = None):
+    global threshold, capture_path
+    threshold = threshold_ms / 1000
+    capture_path = path or None
+
+
+def redact(parameters):
+    """The shape of a statement's parameters without any of their values."""
+    if isinstance(parameters, dict):
+        return {name: type(value).__name__ for name, value in parameters.items()}
+    return [type(value).__name__ for value in parameters]
+
+
+def placeholders(shape):
+    """Parameters that bind `redact`ed ones again, all NULL."""
+    if isinstance(shape, dict):
+        return dict.fromkeys(shape)
+    return [None] * len(shape or [])
+
+
+def plan(conn: sqlite3.Connection, sql: str, shape) -> list[tuple]:
+    """EXPLAIN QUERY PLAN of `sql` as (id, parent, detail) rows."""
+    cursor = sqlite3.Connection.cursor(conn, sqlite3.Cursor)
+    cursor.row_factory = None
+    try:
+        cursor.execute("EXPLAIN QUERY PLAN " + sql, placeholders(shape))
+        return [(row[0], row[1], row[3]) for row in cursor.fetchall()]
+    except sqlite3.Error:
+        return []  # e.g. a statement that can't be explained, like PRAGMA
+    finally:
+        cursor.close()
+
+
+def format_plan(rows) -> str:
+    depth = {0: -1}
+    lines = []
+    for id, parent, detail in rows:
+        depth[id] = depth.get(parent, -1) + 1
+        lines.append("  " * depth[id] + detail)
+    return "\n".join(lines)
+
+
+def record(conn, sql: str, shape, elapsed: float, caller):
+    entry = {
+        "time": time.time(),
+        "caller": caller,
+        "ms": round(elapsed * 1000, 2),
+        "sql": " ".join(sql.split()),
+        "params": shape,
+        "plan": plan(conn, sql, shape),
+    }
+    logger.warning(
+        "slow query (%.1f ms) in %s: %s params=%s\n%s",
+        entry["ms"],
+        caller or "?",
+        entry["sql"],
+        shape,
+        format_plan(entry["plan"]),
+    )
+    if capture_path is not None:
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with _capture_lock:
+            try:
+                with open(capture_path, "a", encoding="utf-8") as f:
+                    f.write(line)
+            except OSError:
+                logger.exception("could not write to %s", capture_path)
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Accumulates the time of one statement across execute and fetches."""
+
+    _sql = None
+    # the row after the one fetchone returned, read to see if it was the
+    # last, and without the row factory, which only sees rows handed out
+    _next_row = None
+
+    def _start(self, sql, shape):
+        self._finish()
+        self._next_row = None
+        self._sql, self._shape, self._elapsed = sql, shape, 0.0
+
+    def _timed(self, method, *args):
+        start = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            if self._sql is not None:
+                self._elapsed += time.perf_counter() - start
+
+    def _finish(self):
+        if self._sql is not None and self._elapsed >= threshold:
+            conn = self.connection
+            record(conn, self._sql, self._shape, self._elapsed, conn.caller)
+        self._sql = None
+
+    def execute(self, sql, parameters=()):
+        self._start(sql, redact(parameters))
+        self._timed(super().execute, sql, parameters)
+        if self.description is None:
+            # nothing to fetch, so nothing more will be timed
+            self._finish()
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        shape = []
+
+        def watch(rows):
+            for row in rows:
+                if not shape:
+                    shape.append(redact(row))
+                yield row
+
+        self._start(sql, None)
+        self._timed(super().executemany, sql, watch(seq_of_parameters))
+        self._shape = shape[0] if shape else []
+        self._finish()
+        return self
+
+    def executescript(self, script):
+        self._finish()
+        return super().executescript(script)
+
+    def _read_ahead(self):
+        factory = self.row_factory
+        self.row_factory = None
+        try:
+            self._next_row = self._timed(super().fetchone)
+        finally:
+            self.row_factory = factory
+
+    def _take_next_row(self) -> list:
+        if self._next_row is None:
+            return []
+        row, self._next_row = self._next_row, None
+        return [self.row_factory(self, row) if self.row_factory else row]
+
+    def fetchone(self):
+        if self._next_row is not None:
+            row = self._take_next_row()[0]
+        else:
+            row = self._timed(super().fetchone)
+        if row is not None and self._sql is not None:
+            # conn.execute(...).fetchone() never asks for the end, so read
+            # one row ahead and finish as soon as there isn't another
+            self._read_ahead()
+        if self._next_row is None:
+            self._finish()
+        return row
+
+    def __next__(self):
+        row = self.fetchone()
+        if row is None:
+            raise StopIteration
+        return row
+
+    def fetchmany(self, size=None):
+        size = size or self.arraysize
+        rows = self._take_next_row()
+        rows += self._timed(super().fetchmany, size - len(rows))
+        if len(rows) < size:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        rows = self._take_next_row()
+        rows += self._timed(super().fetchall)
+        self._finish()
+        return rows
+
+    def close(self):
+        self._finish()
+        super().close()
+
+
+class TimedConnection(sqlite3.Connection):
+    """sqlite3 connection whose cursors feed the slow-query log.
+
+    `caller` is set by the pool to the db function that borrowed it.
+    """
+
+    caller = None
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    # the C implementations of these bypass the cursor's own methods
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def replay(entries, database: str):
+    """Print the current plan of every distinct captured statement."""
+    path = pathname2url(os.path.abspath(database))
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    seen = {}
+    for entry in entries:
+        stats = seen.setdefault(
+            entry["sql"], {"entry": entry, "count": 0, "ms": 0.0, "callers": set()}
+        )
+        stats["count"] += 1
+        stats["ms"] = max(stats["ms"], entry["ms"])
+        stats["callers"].add(entry.get("caller") or "?")
+
+    for sql, stats in sorted(seen.items(), key=lambda item: -item[1]["ms"]):
+        now = plan(conn, sql, stats["entry"]["params"])
+        before = [tuple(row) for row in stats["entry"].get("plan", [])]
+        if not now and not before:
+            continue  # schema changes and pragmas have no plan to compare
+        print(
+            f"-- {stats['count']}x, slowest {stats['ms']:.1f} ms, "
+            f"from {', '.join(sorted(stats['callers']))}"
+        )
+        print(sql)
+        print(format_plan(now) or "(no plan)")
+        if before and before != now:
+            print("-- captured plan was:")
+            print(format_plan(before))
+        print()
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Replay captured slow queries against a database "
+        "and print their plans."
+    )
+    parser.add_argument("log", help="JSON lines written via SLOW_QUERY_LOG")
+    parser.add_argument(
+        "database", help="a copy of the production database (opened read-only)"
+    )
+    args = parser.parse_args()
+
+    with open(args.log, encoding="utf-8") as f:
+        entries = [json.loads(line) for line in f if line.strip()]
+    replay(entries, args.database)
+
+
+if __name__ == "__main__":
+    main()
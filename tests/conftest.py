@@ -0,0 +1,53 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+from skolmaten import create_app, db
+
+
+@pytest.fixture(scope="session")
+def build_dir(tmp_path_factory):
+    # shared, so the assets are only compressed once per run
+    return tmp_path_factory.mktemp("build")
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch, build_dir):
+    """The app on an empty database of its own."""
+    monkeypatch.setenv("DATABASE", str(tmp_path / "database.db"))
+    monkeypatch.setenv("ASSET_BUILD_DIR", str(build_dir))
+    app = create_app()
+    # module-level caches outlive an app; start each test without them
+    from skolmaten import app as views
+
+    db.users_by_token.clear()
+    views.page_cache.clear()
+    yield app
+    db.writer.close()
+    asyncio.run(db.pool.close())
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def signin(client):
+    def signin(name="bob", authlvl=0) -> str:
+        """Register `name` and sign them in on `client`; returns their token."""
+        asyncio.run(db.register(name, "hemligt", authlvl))
+        token = asyncio.run(db.signin(name, "hemligt"))
+        client.set_cookie("token", token)
+        return token
+
+    return signin
+
+
+@pytest.fixture
+def elsewhere(app):
+    """A connection of its own, writing like another worker would."""
+    conn = sqlite3.connect(app.config["DATABASE"], isolation_level=None)
+    yield conn
+    conn.close()
@@ -0,0 +1,58 @@
+"""Serving the app through the native ASGI adapter."""
+
+import asyncio
+
+from flask import request, request_started
+
+from skolmaten import db
+from skolmaten.asgi import ASGIApp
+
+
+def get(app, path, query=b""):
+    scope = {
+        "type": "http",
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "query_string": query,
+        "headers": [(b"host", b"localhost")],
+    }
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(ASGIApp(app)(scope, receive, send))
+    status = sent[0]["status"]
+    return status, b"".join(message.get("body", b"") for message in sent[1:])
+
+
+def test_week_page(app):
+    asyncio.run(db.set_food(2025, 10, 1, "Soppa"))
+    status, body = get(app, "/week/10", b"year=2025")
+    assert status == 200
+    assert "Soppa" in body.decode()
+
+
+def test_request_started_is_sent(app):
+    seen = []
+
+    def sync(sender, **extra):
+        seen.append(("sync", request.args.get("q")))
+
+    async def coro(sender, **extra):
+        seen.append(("async", request.args.get("q")))
+
+    request_started.connect(sync, app)
+    request_started.connect(coro, app)
+    try:
+        # raw UTF-8, as some clients send it unescaped
+        get(app, "/year/2025", "q=smörgås".encode())
+    finally:
+        request_started.disconnect(sync, app)
+        request_started.disconnect(coro, app)
+    assert sorted(seen) == [("async", "smörgås"), ("sync", "smörgås")]
@@ -0,0 +1,66 @@
+"""Cached logins and pages must follow writes made by any worker."""
+
+import asyncio
+
+from skolmaten import db
+
+
+def lookup(token):
+    return asyncio.run(db.user_by_token(token))
+
+
+def test_token_cache_follows_other_workers(signin, elsewhere):
+    token = signin("bob", authlvl=2)
+    user = lookup(token)
+    assert (user["display"], user["auth"]) == ("bob", 2)
+
+    elsewhere.execute("UPDATE users SET display = 'Bobby' WHERE id = ?", (user["id"],))
+    assert lookup(token)["display"] == "Bobby"
+
+    elsewhere.execute("UPDATE users SET name = 'robert' WHERE id = ?", (user["id"],))
+    assert lookup(token)["name"] == "robert"
+
+    elsewhere.execute("UPDATE users SET authlvl = 0 WHERE id = ?", (user["id"],))
+    assert lookup(token)["auth"] == 0
+
+    elsewhere.execute("UPDATE users SET token = NULL WHERE id = ?", (user["id"],))
+    assert lookup(token) is None
+
+
+def test_token_cache_survives_other_sign_ins(signin):
+    token = signin("bob")
+    lookup(token)
+    hits = db.users_by_token.stats()["hits"]
+
+    asyncio.run(db.register("eve", "hemligt", 0))
+    asyncio.run(db.signin("eve", "hemligt"))
+    lookup(token)
+    assert db.users_by_token.stats()["hits"] == hits + 1
+
+
+def test_deleted_user_is_signed_out(signin, elsewhere):
+    token = signin("bob")
+    user = lookup(token)
+    elsewhere.execute("UPDATE users SET deleted = 1 WHERE id = ?", (user["id"],))
+    assert lookup(token)["deleted"] is True
+
+
+def test_week_page_follows_other_workers(client, elsewhere):
+    asyncio.run(db.set_food(2025, 10, 1, "Soppa"))
+    assert "Soppa" in client.get("/week/10?year=2025").get_data(as_text=True)
+
+    elsewhere.execute("UPDATE weeks SET mon = 'Fisk' WHERE year = 2025 AND week = 10")
+    page = client.get("/week/10?year=2025").get_data(as_text=True)
+    assert "Fisk" in page and "Soppa" not in page
+
+
+def test_year_page_counts_new_comments(client, elsewhere):
+    asyncio.run(db.set_food(2025, 10, 1, "Soppa"))
+    client.get("/year/2025")
+
+    elsewhere.execute(
+        "INSERT INTO comments (year, week, day, id, value, author) "
+        "VALUES (2025, 10, 0, 0, 'god', 0)"
+    )
+    page = client.get("/year/2025").get_data(as_text=True)
+    assert '<sup class="comment-count">1</sup>' in page
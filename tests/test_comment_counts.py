@@ -0,0 +1,43 @@
+"""comment_counts, kept by triggers on comments (migration 7)."""
+
+import asyncio
+
+from skolmaten import db
+
+
+def counts():
+    return asyncio.run(db.get_comment_counts_year(2025))
+
+
+def test_triggers_keep_counts(app, elsewhere):
+    async def post():
+        for day in (0, 0, 0, 4):
+            await db.addcomment(2025, 10, day, "god", 0)
+        await db.addcomment(2025, 52, 2, "sist", 0)
+        await db.addcomment(2024, 10, 0, "förra året", 0)
+
+    asyncio.run(post())
+    grid = counts()
+    assert len(grid) == 52 and all(len(week) == 5 for week in grid)
+    assert grid[9] == [3, 0, 0, 0, 1]
+    assert grid[51] == [0, 0, 1, 0, 0]
+    assert sum(map(sum, grid)) == 5
+
+    asyncio.run(db.delcomment(0))  # soft delete
+    asyncio.run(db.delcomment(1, fr=True))  # hard delete
+    assert counts()[9] == [1, 0, 0, 0, 1]
+
+    # moved to another day by some other worker
+    elsewhere.execute("UPDATE comments SET week = 11, day = 3 WHERE id = 3")
+    assert counts()[9:11] == [[1, 0, 0, 0, 0], [0, 0, 0, 1, 0]]
+    assert asyncio.run(db.comment_count_mismatches()) == []
+
+
+def test_rebuild(app, elsewhere):
+    asyncio.run(db.addcomment(2025, 10, 0, "god", 0))
+    elsewhere.execute("UPDATE comment_counts SET n = 7")
+    assert asyncio.run(db.comment_count_mismatches()) == [(2025, 10, 0, 1, 7)]
+
+    asyncio.run(db.rebuild_comment_counts())
+    assert asyncio.run(db.comment_count_mismatches()) == []
+    assert counts()[9][0] == 1
@@ -0,0 +1,112 @@
+"""The incremental food JSON parser and the import it feeds."""
+
+import asyncio
+import io
+import json
+import sqlite3
+
+import pytest
+
+from skolmaten import db
+from skolmaten.foodjson import iter_food_json
+
+MENU = {
+    "2025": {
+        "10": {
+            "monday": 'Fisk "à la" maison\\ med ägg',
+            "tue": "Soppa\nmed bröd",
+            "wednesday": "\U0001f35d Pasta",
+            "sat": "skipped",
+        },
+        "11": {"Fri": "Pizza"},
+    },
+    "2026": {},
+}
+ROWS = [
+    ("2025", "10", 1, 'Fisk "à la" maison\\ med ägg'),
+    ("2025", "10", 2, "Soppa\nmed bröd"),
+    ("2025", "10", 3, "\U0001f35d Pasta"),
+    ("2025", "11", 5, "Pizza"),
+]
+
+
+def parse(data: bytes, chunk_size=64 * 1024):
+    return list(iter_food_json(io.BytesIO(data), chunk_size))
+
+
+@pytest.mark.parametrize("indent", [None, 2])
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 5, 7, 64 * 1024])
+def test_values_split_across_chunks(indent, chunk_size):
+    # ensure_ascii=False puts multi-byte UTF-8 on every chunk boundary,
+    # ensure_ascii=True \\u escapes and surrogate pairs
+    for ascii in (False, True):
+        data = json.dumps(MENU, indent=indent, ensure_ascii=ascii).encode()
+        assert parse(data, chunk_size) == ROWS
+
+
+def test_escapes():
+    data = r'{"2025": {"1": {"mon": "a\"b\\c\/d\u00e5\ud83c\udf5d\t", "tue": "å"}}}'
+    rows = [("2025", "1", 1, 'a"b\\c/då\U0001f35d\t'), ("2025", "1", 2, "å")]
+    assert parse(data.encode(), 3) == rows
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        b"",
+        b"[]",
+        b'{"2025": {"1": {"mon": "a"}}',
+        b'{"2025": {"1": {"mon": "a"}}}}',
+        b'{"2025": {"1": {"mon": "a" "tue": "b"}}}',
+        b'{"2025": {"1": {"mon": "unterminated}}}',
+        b'{"2025": {"1": {"mon": {"nested": "a"}}}}',
+        b'{"2025": {"1": {"mon": ["a"]}}}',
+        b'{2025: {}}',
+        b'{"2025": {"1": {"mon": "a"}}} trailing',
+    ],
+)
+def test_malformed(data):
+    with pytest.raises(ValueError):
+        parse(data, 4)
+
+
+def weeks(app):
+    conn = sqlite3.connect(app.config["DATABASE"])
+    try:
+        return conn.execute(
+            "SELECT year, week, mon, tue, wed, thu, fri FROM weeks ORDER BY year, week"
+        ).fetchall()
+    finally:
+        conn.close()
+
+
+def test_import(app):
+    data = json.dumps(MENU).encode()
+    summary = asyncio.run(db.set_food_bulk(iter_food_json(io.BytesIO(data), 5), 2))
+    assert (summary["inserted"], summary["updated"], summary["unchanged"]) == (4, 0, 0)
+    assert weeks(app) == [
+        (2025, 10, ROWS[0][3], ROWS[1][3], ROWS[2][3], "", ""),
+        (2025, 11, "", "", "", "", "Pizza"),
+    ]
+
+    summary = asyncio.run(db.set_food_bulk(iter_food_json(io.BytesIO(data))))
+    assert (summary["inserted"], summary["updated"], summary["unchanged"]) == (0, 0, 4)
+
+
+@pytest.mark.parametrize(
+    "tail",
+    [
+        b', "13": {"mon": 5}}}',  # a bad row after several staged batches
+        b', "13": {"mon": "a"}',  # malformed JSON at the very end
+    ],
+)
+def test_a_bad_row_rolls_back_the_whole_import(app, tail):
+    asyncio.run(db.set_food(2025, 1, 1, "Gammal"))
+    before = weeks(app)
+    data = b'{"2025": {' + b", ".join(
+        b'"%d": {"mon": "Ny %d", "tue": "Ny"}' % (week, week) for week in range(1, 13)
+    ) + tail
+
+    with pytest.raises(ValueError):
+        asyncio.run(db.set_food_bulk(iter_food_json(io.BytesIO(data), 16), 3))
+    assert weeks(app) == before
@@ -0,0 +1,78 @@
+"""Conditional GETs and the paginated comment listing."""
+
+import asyncio
+import json
+
+import pytest
+
+from skolmaten import db
+
+
+@pytest.mark.parametrize(
+    "url", ["/week/10?year=2025", "/year/2025", "/comments/day/2025/10/0"]
+)
+def test_not_modified_until_a_write(client, url):
+    asyncio.run(db.set_food(2025, 10, 1, "Soppa"))
+    first = client.get(url)
+    assert first.status_code == 200
+    etag = first.headers["ETag"]
+
+    again = client.get(url, headers={"If-None-Match": etag})
+    assert again.status_code == 304
+    assert again.headers["ETag"] == etag
+
+    modified = first.headers["Last-Modified"]
+    since = client.get(url, headers={"If-Modified-Since": modified})
+    assert since.status_code == 304
+
+    asyncio.run(db.addcomment(2025, 10, 0, "god", 0))
+    changed = client.get(url, headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != etag
+
+
+def test_other_weeks_stay_not_modified(client):
+    asyncio.run(db.set_food(2025, 10, 1, "Soppa"))
+    etag = client.get("/week/10?year=2025").headers["ETag"]
+    asyncio.run(db.set_food(2025, 11, 1, "Fisk"))
+    resp = client.get("/week/10?year=2025", headers={"If-None-Match": etag})
+    assert resp.status_code == 304
+
+
+def test_etag_depends_on_the_viewer(client, signin):
+    asyncio.run(db.set_food(2025, 10, 1, "Soppa"))
+    etag = client.get("/week/10?year=2025").headers["ETag"]
+    signin("bob")
+    resp = client.get("/week/10?year=2025", headers={"If-None-Match": etag})
+    assert resp.status_code == 200
+
+
+@pytest.fixture
+def comments(app):
+    async def post():
+        for i in range(7):
+            await db.addcomment(2025, 10, i % 5, f"kommentar {i}", 0)
+
+    asyncio.run(post())
+
+
+def test_keyset_pages(client, comments):
+    ids, after = [], -1
+    while after is not None:
+        body = client.get(f"/comments/all?after={after}&limit=3").get_json()
+        assert len(body["comments"]) <= 3
+        ids += [comment["id"] for comment in body["comments"]]
+        after = body["next"]
+    assert ids == list(range(7))
+
+
+def test_ndjson(client, comments):
+    resp = client.get("/comments/all?format=ndjson&after=2")
+    assert resp.mimetype == "application/x-ndjson"
+    lines = [json.loads(line) for line in resp.get_data(as_text=True).splitlines()]
+    assert [line["id"] for line in lines] == [3, 4, 5, 6]
+    assert lines[0]["comment"] == "kommentar 3"
+
+
+def test_everything_at_once(client, comments):
+    assert len(client.get("/comments/all").get_json()) == 7
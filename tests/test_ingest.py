@@ -0,0 +1,52 @@
+"""Years inferred from a menu's printed dates."""
+
+import pytest
+
+from skolmaten.pdf2json import infer_year, iter_menu
+
+
+@pytest.mark.parametrize(
+    "week, weekday, date, around, year",
+    [
+        (10, 1, "3/3", 2025, 2025),
+        (1, 1, "30/12", 2025, 2025),  # ISO week 1 of 2025 starts in 2024
+        (52, 5, "27/12", 2025, 2024),
+        (1, 3, "1/1", 2025, 2025),
+        (1, 3, "1/1", 2026, 2025),
+        (53, 1, "28/12", 2025, 2026),
+        (10, 1, "4/3", 2025, 2024),  # monday of week 10 the year before
+        (10, 1, "5/3", 2025, None),
+        (10, 1, "31/2", 2025, None),
+        (10, 1, "mars", 2025, None),
+    ],
+)
+def test_infer_year(week, weekday, date, around, year):
+    assert infer_year(week, weekday, date, around) == year
+
+
+def test_menu_across_new_year():
+    page = """
+        V. 52
+        Mån 22/12 Gröt
+        Fre 26/12 Stängt
+        V. 1
+        Mån 29/12 Soppa
+        Fre 2/1 Fisk
+        V. 2
+        Mån 5/1 Pasta
+        Tis 99/1 Pizza
+    """
+    assert list(iter_menu([page], year=None, around=2025)) == [
+        ("2025", 52, "mon", "Gröt"),
+        ("2025", 52, "fri", "Stängt"),
+        ("2026", 1, "mon", "Soppa"),
+        ("2026", 1, "fri", "Fisk"),
+        ("2026", 2, "mon", "Pasta"),
+        # no date fits, so the year of the day before
+        ("2026", 2, "tue", "Pizza"),
+    ]
+
+
+def test_fixed_year():
+    page = "V. 10\nMån 3/3 Soppa\n"
+    assert list(iter_menu([page], year=2030)) == [("2030", 10, "mon", "Soppa")]
@@ -0,0 +1,48 @@
+"""Adding up the figures workers leave in METRICS_DIR."""
+
+import json
+import os
+import subprocess
+import sys
+
+from skolmaten.metrics import Registry
+
+
+def leave(directory, pid, value):
+    snapshot = {"counters": [["db_writes_total", [], value]], "histograms": []}
+    (directory / f"{pid}-0badc0de.json").write_text(json.dumps(snapshot))
+
+
+def total(registry) -> float:
+    return registry.collect()["counters"].get(("db_writes_total", ()), 0)
+
+
+def exited_pid() -> int:
+    proc = subprocess.Popen([sys.executable, "-c", "pass"])
+    proc.wait()
+    return proc.pid
+
+
+def test_files_of_exited_workers_are_removed(tmp_path):
+    registry = Registry()
+    registry.configure(str(tmp_path))
+    leave(tmp_path, os.getpid(), 2)
+    leave(tmp_path, exited_pid(), 5)
+
+    assert total(registry) == 2
+    assert [path.name for path in tmp_path.iterdir()] == [
+        f"{os.getpid()}-0badc0de.json"
+    ]
+
+
+def test_worker_removes_its_file_on_exit(tmp_path):
+    registry = Registry()
+    registry.configure(str(tmp_path))
+    registry.inc("db_writes_total")
+    registry.flush()
+    assert len(list(tmp_path.iterdir())) == 1
+
+    registry.remove()
+    assert list(tmp_path.iterdir()) == []
+    registry.flush()
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,103 @@
+"""Upgrading a database from before the migrations existed."""
+
+import asyncio
+import sqlite3
+
+import aiosqlite
+
+from skolmaten import migrations
+
+# the schema the app created before user_version was used: version 0
+BASELINE = """
+CREATE TABLE users (
+    token TEXT,
+    id INT PRIMARY KEY UNIQUE,
+    name TEXT UNIQUE NOT NULL,
+    pass TEXT NOT NULL,
+    authlvl INTEGER DEFAULT 0,
+    display TEXT,
+    deleted INT DEFAULT 0
+);
+CREATE TABLE weeks (
+    week INT, year INT, mon TEXT, tue TEXT, wed TEXT, thu TEXT, fri TEXT
+);
+CREATE TABLE comments (
+    week INT, year INT, day INT, id INT PRIMARY KEY, value TEXT, author INT
+);
+INSERT INTO users VALUES ('t', 0, 'adminacc', 'x', 3, 'Admin', 0);
+-- set_food used to insert a new row per day, so one week has several rows
+INSERT INTO weeks VALUES (10, 2025, 'Soppa', NULL, NULL, NULL, NULL);
+INSERT INTO weeks VALUES (10, 2025, NULL, 'Fisk', NULL, NULL, NULL);
+INSERT INTO weeks VALUES (10, 2025, NULL, NULL, NULL, NULL, 'Pizza');
+INSERT INTO weeks VALUES (11, 2025, 'Gröt', NULL, NULL, NULL, NULL);
+INSERT INTO weeks VALUES (NULL, 2025, 'lost', NULL, NULL, NULL, NULL);
+INSERT INTO comments VALUES (10, 2025, 0, 0, 'god soppa', 0);
+INSERT INTO comments VALUES (10, 2025, 0, 1, 'mums', 0);
+INSERT INTO comments VALUES (10, 2025, 1, 2, '<Deleted>', 0);
+"""
+
+
+def baseline(path):
+    conn = sqlite3.connect(path)
+    conn.executescript(BASELINE)
+    conn.close()
+
+
+async def upgrade(path) -> int:
+    async with aiosqlite.connect(path) as db:
+        return await migrations.migrate(db)
+
+
+def test_upgrades_baseline_to_latest(tmp_path):
+    path = str(tmp_path / "database.db")
+    baseline(path)
+
+    assert asyncio.run(upgrade(path)) == len(migrations.MIGRATIONS)
+
+    conn = sqlite3.connect(path)
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == len(
+        migrations.MIGRATIONS
+    )
+    # duplicate rows merged into one per week, rows without a week dropped
+    assert conn.execute(
+        "SELECT year, week, mon, tue, wed, thu, fri FROM weeks ORDER BY week"
+    ).fetchall() == [
+        (2025, 10, "Soppa", "Fisk", None, None, "Pizza"),
+        (2025, 11, "Gröt", None, None, None, None),
+    ]
+    # the backfills of the search index and the comment counts
+    assert conn.execute(
+        "SELECT rowid FROM dishes_fts WHERE dishes_fts MATCH 'fisk'"
+    ).fetchall() == [(2025 * 1000 + 10 * 10 + 1,)]
+    assert conn.execute(
+        "SELECT rowid FROM comments_fts WHERE comments_fts MATCH 'soppa'"
+    ).fetchall() == [(0,)]
+    assert conn.execute(
+        "SELECT year, week, day, n FROM comment_counts"
+    ).fetchall() == [(2025, 10, 0, 2)]
+    conn.close()
+
+
+def test_upgrade_is_idempotent(tmp_path):
+    path = str(tmp_path / "database.db")
+    baseline(path)
+    asyncio.run(upgrade(path))
+    schema = sqlite3.connect(path).execute("SELECT sql FROM sqlite_master").fetchall()
+
+    assert asyncio.run(upgrade(path)) == len(migrations.MIGRATIONS)
+    assert (
+        sqlite3.connect(path).execute("SELECT sql FROM sqlite_master").fetchall()
+        == schema
+    )
+
+
+def test_concurrent_upgrades(tmp_path):
+    path = str(tmp_path / "database.db")
+    baseline(path)
+
+    async def both():
+        return await asyncio.gather(upgrade(path), upgrade(path))
+
+    assert asyncio.run(both()) == [len(migrations.MIGRATIONS)] * 2
+    conn = sqlite3.connect(path)
+    assert conn.execute("SELECT COUNT(*) FROM weeks").fetchone()[0] == 2
@@ -0,0 +1,63 @@
+"""Statements per db call must not grow with the rows they return."""
+
+import asyncio
+import sqlite3
+
+import pytest
+
+from skolmaten import db
+
+YEAR, WEEK = 2025, 10
+
+# statements each call issues, whatever the size of the tables
+CALLS = {
+    "getcomments": (lambda: db.getcomments(YEAR, WEEK, 0), 1),
+    "getallcomments": (db.getallcomments, 1),
+    "comment_by_id": (lambda: db.comment_by_id(0), 1),
+    "get_author_by_comment_id": (lambda: db.get_author_by_comment_id(0), 1),
+    "get_week": (lambda: db.get_week(YEAR, WEEK), 1),
+    "get_comment_counts_year": (lambda: db.get_comment_counts_year(YEAR), 1),
+}
+
+
+def seed_comments(path, weeks, per_day):
+    conn = sqlite3.connect(path)
+    (start,) = conn.execute("SELECT COALESCE(MAX(id), -1) + 1 FROM comments").fetchone()
+    conn.executemany(
+        "INSERT INTO comments (year, week, day, id, value, author) "
+        "VALUES (?, ?, ?, ?, ?, 0)",
+        [
+            (YEAR, week, day, start + i, f"kommentar {i}")
+            for i, (week, day) in enumerate(
+                (week, day)
+                for week in weeks
+                for day in range(5)
+                for _ in range(per_day)
+            )
+        ],
+    )
+    conn.commit()
+    conn.close()
+
+
+def count(fn) -> int:
+    before = db.pool.stats()["queries"]
+    asyncio.run(fn())
+    return db.pool.stats()["queries"] - before
+
+
+@pytest.fixture
+def counts(app):
+    asyncio.run(db.set_food(YEAR, WEEK, 1, "Soppa"))
+    seed_comments(app.config["DATABASE"], [WEEK], per_day=1)
+    small = {name: count(fn) for name, (fn, _) in CALLS.items()}
+    seed_comments(app.config["DATABASE"], range(1, 53), per_day=20)
+    large = {name: count(fn) for name, (fn, _) in CALLS.items()}
+    return small, large
+
+
+@pytest.mark.parametrize("name", CALLS)
+def test_statement_count(counts, name):
+    small, large = counts
+    expected = CALLS[name][1]
+    assert (small[name], large[name]) == (expected, expected)
@@ -0,0 +1,83 @@
+"""Full-text search over dishes and comments."""
+
+import asyncio
+
+import pytest
+
+from skolmaten import db
+
+
+def search(query, source="dishes", **kwargs):
+    return asyncio.run(db.search(query, source, **kwargs))
+
+
+@pytest.fixture
+def menu(app):
+    async def seed():
+        await db.set_food_bulk(
+            [
+                (2024, 50, 1, "Fiskgratäng med potatis"),
+                (2025, 3, 2, "Pannkakor med sylt"),
+                (2025, 10, 1, "Stekt fisk och potatismos"),
+                (2025, 10, 5, "Pizza"),
+            ]
+        )
+        await db.addcomment(2025, 10, 0, "Fisken var god", 0)
+        await db.addcomment(2025, 10, 1, "Fisk igen?", 0)
+        await db.addcomment(2025, 10, 2, "Mer fisk", 0)
+
+    asyncio.run(seed())
+
+
+def test_prefixes_ignoring_case_and_diacritics(menu):
+    hits = search("fiskgratang")
+    assert [(h["year"], h["week"], h["day"]) for h in hits] == [(2024, 50, 0)]
+    assert hits[0]["date"] == "2024-12-09"
+    assert hits[0]["highlighted"] == [["Fiskgratäng", True], [" med potatis", False]]
+
+    assert {h["dish"] for h in search("POTATIS")} == {
+        "Fiskgratäng med potatis",
+        "Stekt fisk och potatismos",
+    }
+
+
+def test_every_word_must_match(menu):
+    assert [h["dish"] for h in search("fisk potatismos")] == [
+        "Stekt fisk och potatismos"
+    ]
+    assert search("fisk pizza") == []
+
+
+def test_newest_first_and_paging(menu):
+    newest = search("potatis", newest=True)
+    assert [h["year"] for h in newest] == [2025, 2024]
+    assert search("potatis", newest=True, limit=1, offset=1) == newest[1:]
+
+
+def test_user_input_is_not_fts_syntax(menu):
+    for query in ['"', "fisk OR pizza", "NEAR(", "*", "fisk -potatis", ""]:
+        search(query)
+    assert search("fisk OR pizza") == []
+
+
+def test_comments_follow_edits_and_deletes(menu):
+    assert len(search("fisk", "comments")) == 3
+    ids = [h["id"] for h in search("fisk", "comments")]
+
+    asyncio.run(db.delcomment(ids[0]))  # soft delete
+    asyncio.run(db.delcomment(ids[1], fr=True))  # hard delete
+    assert [h["id"] for h in search("fisk", "comments")] == ids[2:]
+    assert search("deleted", "comments") == []
+
+
+def test_dishes_follow_edits(menu):
+    asyncio.run(db.set_food(2025, 10, 5, "Fiskpinnar"))
+    assert search("pizza") == []
+    assert [h["dish"] for h in search("fiskpinnar")] == ["Fiskpinnar"]
+
+
+def test_route(client, menu):
+    body = client.get("/search?q=potatis&format=json&limit=1").get_json()
+    assert len(body["hits"]) == 1 and body["next"] == 1
+    assert client.get("/search?q=fisk&source=comments").status_code == 200
+    assert client.get("/search?q=fisk&source=users").status_code == 400
@@ -0,0 +1,80 @@
+"""Timing statements across their fetches, and replaying the captured ones."""
+
+import logging
+import sqlite3
+
+import pytest
+
+from skolmaten import slowlog
+
+
+@pytest.fixture
+def conn(monkeypatch):
+    monkeypatch.setattr(slowlog, "threshold", 0.0)
+    monkeypatch.setattr(slowlog, "capture_path", None)
+    conn = sqlite3.connect(":memory:", factory=slowlog.TimedConnection)
+    conn.execute("CREATE TABLE t (x)")
+    conn.executemany("INSERT INTO t VALUES (?)", [(i,) for i in range(5)])
+    yield conn
+    conn.close()
+
+
+def logged(caplog) -> list[str]:
+    return [
+        record.getMessage().split(": ", 1)[1].split(" params=")[0]
+        for record in caplog.records
+        if record.name == "skolmaten.slowquery"
+    ]
+
+
+@pytest.mark.parametrize(
+    "read",
+    [
+        lambda conn: conn.execute("SELECT x FROM t WHERE x = 3").fetchone(),
+        lambda conn: list(conn.execute("SELECT x FROM t WHERE x = 3")),
+        lambda conn: conn.execute("SELECT x FROM t WHERE x = 3").fetchall(),
+        lambda conn: conn.execute("SELECT x FROM t WHERE x = 3").fetchmany(5),
+    ],
+)
+def test_logged_once_read_to_the_end(conn, caplog, read):
+    caplog.set_level(logging.WARNING, "skolmaten.slowquery")
+    assert list(read(conn)) in ([3], [(3,)])
+    assert logged(caplog) == ["SELECT x FROM t WHERE x = 3"]
+
+
+def test_logged_when_the_cursor_is_reused(conn, caplog):
+    caplog.set_level(logging.WARNING, "skolmaten.slowquery")
+    cursor = conn.cursor()
+    cursor.execute("SELECT x FROM t")
+    assert cursor.fetchone() == (0,)
+    assert logged(caplog) == []
+    cursor.execute("SELECT 1")
+    assert logged(caplog) == ["SELECT x FROM t"]
+
+
+def test_read_ahead_counts_only_rows_returned(conn):
+    counted = []
+
+    def factory(cursor, row):
+        counted.append(row)
+        return row
+
+    cursor = conn.cursor()
+    cursor.row_factory = factory
+    cursor.execute("SELECT x FROM t")
+    assert cursor.fetchone() == (0,)
+    assert counted == [(0,)]
+    assert cursor.fetchmany(2) == [(1,), (2,)]
+    assert cursor.fetchall() == [(3,), (4,)]
+    assert counted == [(i,) for i in range(5)]
+
+
+def test_replay_path_with_uri_characters(tmp_path, capsys):
+    database = tmp_path / "copy #1?.db"
+    conn = sqlite3.connect(database)
+    conn.execute("CREATE TABLE t (x)")
+    conn.close()
+
+    entry = {"sql": "SELECT x FROM t", "params": [], "ms": 1.0, "plan": []}
+    slowlog.replay([entry], str(database))
+    assert "SCAN t" in capsys.readouterr().out
@@ -0,0 +1,42 @@
+"""The writer thread and the ids it hands out."""
+
+import asyncio
+import sqlite3
+
+import pytest
+
+from skolmaten import db
+from skolmaten.pool import Writer
+
+
+def test_write_fails_when_the_database_cannot_be_opened(tmp_path):
+    writer = Writer(str(tmp_path / "missing" / "database.db"))
+
+    # queued before the thread found out, and submitted after it stopped
+    for _ in range(2):
+        with pytest.raises(RuntimeError, match="stopped"):
+            asyncio.run(writer.write(db._execute, "SELECT 1"))
+
+
+def test_comment_ids_after_a_hard_delete(tmp_path):
+    path = str(tmp_path / "database.db")
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE comments "
+        "(week INT, year INT, day INT, id INT PRIMARY KEY, value TEXT, author INT)"
+    )
+    conn.close()
+    writer = Writer(path)
+
+    async def post(n):
+        for i in range(n):
+            await writer.write(db._insert_comment, 2025, 10, 0, f"kommentar {i}", 0)
+
+    asyncio.run(post(3))
+    asyncio.run(writer.write(db._execute, "DELETE FROM comments WHERE id = 0"))
+    asyncio.run(post(2))
+    writer.close()
+
+    conn = sqlite3.connect(path)
+    ids = [row[0] for row in conn.execute("SELECT id FROM comments ORDER BY id")]
+    assert ids == [1, 2, 3, 4]